@@ -0,0 +1,140 @@
+import os
+import json
+import base64
+import logging
+from servicenow_api import SN_BASE_URL, sn_client
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# API endpoint for sending many REST requests in one round trip
+BATCH_API_ENDPOINT = f'{SN_BASE_URL}/api/now/v1/batch'
+
+# Number of sub-requests sent in a single Batch API call
+SN_BATCH_SIZE = int(os.getenv('SN_BATCH_SIZE', '50'))
+
+# Headers attached to every sub-request
+SUB_REQUEST_HEADERS = [
+    {'name': 'Content-Type', 'value': 'application/json'},
+    {'name': 'Accept', 'value': 'application/json'},
+]
+
+
+# Queues record updates and writes them through the ServiceNow Batch API.
+# Updates to the same record are merged into a single PATCH as long as they do not
+# set a field to two different values (e.g. state 6 followed by state 7); such an
+# update starts a second PATCH for that record, which is sent in a later batch
+# call so the instance applies them in the order they were queued.
+class BatchWriter:
+    def __init__(self, batch_size=SN_BATCH_SIZE, max_pending=None):
+        self.batch_size = batch_size
+        # Flush automatically once this many records have updates queued
+        self.max_pending = max_pending
+        # (table, sys_id) -> list of field dicts, one per PATCH still to send
+        self.pending = {}
+        # Totals over every flush, for reporting at the end of a run
+        self.applied = 0
+        self.failed = 0
+
+    def queue(self, table, sys_id, fields):
+        if not fields:
+            return
+        patches = self.pending.setdefault((table, sys_id), [{}])
+        last = patches[-1]
+        if any(key in last and last[key] != value for key, value in fields.items()):
+            patches.append(dict(fields))
+        else:
+            last.update(fields)
+        if self.max_pending and len(self.pending) >= self.max_pending:
+            self.flush()
+
+    def queue_incident(self, sys_id, fields):
+        self.queue('incident', sys_id, fields)
+
+    # Send everything queued; returns one result dict per queued PATCH. Follow-up
+    # PATCHes of a record whose earlier PATCH failed are not sent and come back with
+    # status_code None and skipped set.
+    def flush(self):
+        pending, self.pending = self.pending, {}
+        results = []
+        # Records whose earlier PATCH failed; their follow-up PATCHes are not sent
+        failed_keys = set()
+        rounds = max((len(patches) for patches in pending.values()), default=0)
+        for index in range(rounds):
+            sub_requests = []
+            for (table, sys_id), patches in pending.items():
+                if index >= len(patches):
+                    continue
+                if (table, sys_id) in failed_keys:
+                    results.append(self.result((table, sys_id, patches[index]), None, skipped=True))
+                else:
+                    sub_requests.append((table, sys_id, patches[index]))
+            for start in range(0, len(sub_requests), self.batch_size):
+                for result in self.send(sub_requests[start:start + self.batch_size]):
+                    if not result['ok']:
+                        failed_keys.add((result['table'], result['sys_id']))
+                    results.append(result)
+        failed = sum(1 for result in results if not result['ok'])
+        skipped = sum(1 for result in results if result['skipped'])
+        self.applied += len(results) - failed
+        self.failed += failed
+        if results:
+            logger.info(f'Batch flush: {len(results) - failed} updates applied, {failed} failed '
+                        f'({skipped} skipped after an earlier failure)')
+        return results
+
+    def send(self, sub_requests):
+        by_id = {}
+        rest_requests = []
+        for number, (table, sys_id, fields) in enumerate(sub_requests):
+            request_id = str(number)
+            by_id[request_id] = (table, sys_id, fields)
+            rest_requests.append({
+                'id': request_id,
+                'method': 'PATCH',
+                'url': f'/api/now/table/{table}/{sys_id}',
+                'headers': SUB_REQUEST_HEADERS,
+                'body': base64.b64encode(json.dumps(fields).encode()).decode(),
+                'exclude_response_headers': True,
+            })
+        payload = {'batch_request_id': '1', 'rest_requests': rest_requests}
+        with metrics.stage('batch_write'):
+            response = sn_client.post(BATCH_API_ENDPOINT, json=payload)
+
+        if response.status_code != 200:
+            logger.error(f'Error sending batch of {len(rest_requests)} updates: {response.status_code}')
+            return [self.result(by_id[request_id], response.status_code) for request_id in by_id]
+
+        results = []
+        data = response.json()
+        for serviced in data.get('serviced_requests', []):
+            target = by_id.pop(serviced.get('id'), None)
+            if target is None:
+                continue
+            result = self.result(target, serviced.get('status_code'))
+            if not result['ok']:
+                logger.error(f'Error updating {target[0]} {target[1]}: {result["status_code"]}')
+            results.append(result)
+        # Anything not serviced (e.g. the batch hit the instance time limit) failed
+        for request_id, target in by_id.items():
+            logger.error(f'Update for {target[0]} {target[1]} was not serviced')
+            results.append(self.result(target, None))
+        return results
+
+    @staticmethod
+    def result(target, status_code, skipped=False):
+        table, sys_id, fields = target
+        return {
+            'table': table,
+            'sys_id': sys_id,
+            'fields': sorted(fields),
+            'status_code': status_code,
+            'ok': status_code is not None and 200 <= status_code < 300,
+            'skipped': skipped,
+        }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
@@ -0,0 +1,314 @@
+import os
+import sys
+import json
+import time
+import socket
+import logging
+import argparse
+import tempfile
+import tracemalloc
+import subprocess
+import contextlib
+from functools import wraps
+from datetime import datetime, timezone
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import requests
+
+logger = logging.getLogger('benchmark')
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+FLOWS = ['fetch', 'extract', 'resolve', 'batch']
+
+# (module, function) pairs timed as stages; nested calls are timed separately,
+# e.g. add_comment includes the generate_text call it makes
+STAGES = [
+    ('servicenow_api', 'fetch_page'),
+    ('servicenow', 'get_assignment_group'),
+    ('servicenow', 'extract_field_info'),
+    ('servicenow', 'generate_text'),
+    ('servicenow', 'prefetch_comments'),
+    ('servicenow', 'add_comment'),
+    ('servicenow', 'update_incident_state'),
+    ('servicenow', 'resolve_incident'),
+    ('batch_writer', 'BatchWriter.send'),
+]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+# Collects per-stage call latencies by wrapping the functions listed in STAGES
+class StageTimer:
+    def __init__(self):
+        self.samples = {}
+
+    def install(self, modules):
+        for module_name, qualname in STAGES:
+            owner = modules[module_name]
+            *parents, name = qualname.split('.')
+            for parent in parents:
+                owner = getattr(owner, parent)
+            setattr(owner, name, self.wrap(qualname, getattr(owner, name)))
+
+    def wrap(self, stage, func):
+        samples = self.samples.setdefault(stage, [])
+
+        @wraps(func)
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                samples.append(time.perf_counter() - started)
+        return timed
+
+    def reset(self):
+        for samples in self.samples.values():
+            samples.clear()
+
+    def summary(self):
+        stages = {}
+        for stage, samples in self.samples.items():
+            if not samples:
+                continue
+            ordered = sorted(samples)
+            stages[stage] = {
+                'count': len(ordered),
+                'total_s': round(sum(ordered), 4),
+                'p50_ms': round(percentile(ordered, 0.50) * 1000, 3),
+                'p99_ms': round(percentile(ordered, 0.99) * 1000, 3),
+            }
+        return stages
+
+
+# Starts mock_servicenow.py in its own process so it does not compete for our GIL
+@contextlib.contextmanager
+def mock_server(args):
+    port = args.port or free_port()
+    command = [sys.executable, os.path.join(HERE, 'mock_servicenow.py'), '--port', str(port),
+               '--incidents', '0', '--llm-latency-ms', str(args.llm_latency_ms),
+               '--llm-error-rate', str(args.llm_error_rate), '--llm-429-rate', str(args.llm_429_rate),
+               '--sn-latency-ms', str(args.sn_latency_ms), '--sn-429-rate', str(args.sn_429_rate)]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f'http://127.0.0.1:{port}'
+    try:
+        for _ in range(100):
+            try:
+                requests.get(f'{base_url}/mock/stats', timeout=1)
+                break
+            except requests.ConnectionError:
+                time.sleep(0.1)
+        else:
+            raise RuntimeError('Mock server did not start')
+        yield base_url
+    finally:
+        process.terminate()
+        process.wait()
+
+
+# Point the scripts at the mock server; must run before they are imported
+def configure_environment(base_url, args, workdir):
+    os.environ['SN_BASE_URL'] = base_url
+    os.environ['OPENAI_BASE_URL'] = f'{base_url}/v1'
+    os.environ['OPENAI_API_KEY'] = 'mock'
+    os.environ['OPENAI_MODEL'] = 'mock-instruct'
+    os.environ['SNUSERNAME'] = 'bench'
+    os.environ['SNPASSWORD'] = 'bench'
+    os.environ['SN_RATE_LIMIT'] = str(args.sn_rate_limit)
+    os.environ['SN_PAGE_SIZE'] = str(args.page_size)
+    os.environ['LLM_CACHE_PATH'] = os.path.join(workdir, 'llm_cache.sqlite')
+    os.environ.pop('REF_CACHE_DIR', None)
+
+
+def import_scripts():
+    import servicenow_api
+    import reference_cache
+    import completion_cache
+    import batch_writer
+    import servicenow
+    return {
+        'servicenow_api': servicenow_api,
+        'reference_cache': reference_cache,
+        'completion_cache': completion_cache,
+        'batch_writer': batch_writer,
+        'servicenow': servicenow,
+    }
+
+
+def limited(incidents, sample):
+    for count, incident in enumerate(incidents):
+        if sample and count >= sample:
+            return
+        yield incident
+
+
+def run_flow(flow, modules, args):
+    servicenow = modules['servicenow']
+    processed = 0
+    if flow == 'fetch':
+        for _ in servicenow.fetch_open_incidents():
+            processed += 1
+    elif flow == 'extract':
+        for incident in limited(servicenow.fetch_open_incidents(), args.sample):
+            servicenow.extract_field_info(incident, incident.get('sys_id'))
+            processed += 1
+    elif flow == 'resolve':
+        # Collect first: resolving makes incidents inactive, which would shift the pages
+        incidents = list(limited(servicenow.fetch_open_incidents(), args.sample))
+        for incident in incidents:
+            servicenow.resolve_incident(incident.get('sys_id'))
+            processed += 1
+    elif flow == 'batch':
+        servicenow.process_incidents_batched(args.batch_size)
+        processed = None
+    return processed
+
+
+def reset_state(modules, base_url, size, args):
+    requests.post(f'{base_url}/mock/reset', json={'incidents': size, 'seed': args.seed}).raise_for_status()
+    reference_cache = modules['reference_cache']
+    reference_cache.assignment_groups.clear()
+    reference_cache.users.clear()
+    # Start every flow with an empty completion cache, so earlier flows do not warm later ones
+    modules['completion_cache'].completion_cache.clear()
+
+
+# Peak RSS of the whole benchmark process; ru_maxrss never goes down, so this is
+# reported once per run and the per-flow figure comes from tracemalloc
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def run_benchmarks(args):
+    results = []
+    with tempfile.TemporaryDirectory() as workdir, mock_server(args) as base_url:
+        configure_environment(base_url, args, workdir)
+        # The scripts log every incident at INFO/WARNING; keep only errors from them
+        logging.getLogger().setLevel(logging.ERROR)
+        logger.setLevel(logging.INFO)
+        with contextlib.redirect_stdout(open(os.devnull, 'w')):
+            modules = import_scripts()
+        timer = StageTimer()
+        timer.install(modules)
+        if args.trace_memory:
+            tracemalloc.start()
+
+        for size in args.sizes:
+            for flow in args.flows:
+                reset_state(modules, base_url, size, args)
+                timer.reset()
+                if args.trace_memory:
+                    tracemalloc.reset_peak()
+                started = time.perf_counter()
+                with contextlib.redirect_stdout(open(os.devnull, 'w')):
+                    processed = run_flow(flow, modules, args)
+                wall = time.perf_counter() - started
+                stats = requests.get(f'{base_url}/mock/stats').json()
+                if processed is None:
+                    processed = size
+                result = {
+                    'size': size,
+                    'flow': flow,
+                    'incidents': processed,
+                    'wall_s': round(wall, 3),
+                    'throughput_per_s': round(processed / wall, 2) if wall else None,
+                    'stages': timer.summary(),
+                    'requests': stats['requests'],
+                    'status': stats['status'],
+                }
+                if args.trace_memory:
+                    result['peak_traced_mb'] = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 2)
+                results.append(result)
+                logger.info(f'{flow:>8} n={size:<7} {processed} incidents in {wall:.2f}s '
+                            f'({result["throughput_per_s"]}/s), '
+                            f'{sum(v for k, v in stats["requests"].items() if k != "mock")} requests')
+    return results
+
+
+# Function to compare throughput with a previous results file.
+# Returns the (size, flow) pairs that got slower by more than the tolerance.
+def compare_with_baseline(results, baseline_path, tolerance):
+    with open(baseline_path) as f:
+        baseline = {(r['size'], r['flow']): r for r in json.load(f).get('results', [])}
+    regressions = []
+    for result in results:
+        previous = baseline.get((result['size'], result['flow']))
+        if not previous or not previous.get('throughput_per_s') or not result.get('throughput_per_s'):
+            continue
+        change = result['throughput_per_s'] / previous['throughput_per_s'] - 1
+        if change < -tolerance:
+            regressions.append((result['size'], result['flow'], round(change * 100, 1)))
+            logger.warning(f'Regression: {result["flow"]} n={result["size"]} throughput {change:+.1%} '
+                           f'({previous["throughput_per_s"]}/s -> {result["throughput_per_s"]}/s)')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end benchmark of the incident scripts against the mock server')
+    parser.add_argument('--sizes', default='1000,10000,100000',
+                        help='comma separated incident counts (default: 1000,10000,100000)')
+    parser.add_argument('--flows', default=','.join(FLOWS), help=f'comma separated subset of {FLOWS}')
+    parser.add_argument('--sample', type=int, default=None,
+                        help='process at most this many incidents in the extract/resolve flows')
+    parser.add_argument('--page-size', type=int, default=500)
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--sn-rate-limit', type=float, default=0, help='client-side rate limit, 0 disables')
+    parser.add_argument('--llm-latency-ms', type=float, default=20.0)
+    parser.add_argument('--llm-error-rate', type=float, default=0.0)
+    parser.add_argument('--llm-429-rate', type=float, default=0.0)
+    parser.add_argument('--sn-latency-ms', type=float, default=0.0)
+    parser.add_argument('--sn-429-rate', type=float, default=0.0)
+    parser.add_argument('--no-trace-memory', dest='trace_memory', action='store_false',
+                        help='skip the per-flow peak of Python allocations (tracemalloc slows the run)')
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--baseline', help='previous results file to check for throughput regressions')
+    parser.add_argument('--tolerance', type=float, default=0.10,
+                        help='allowed throughput drop against the baseline (default 0.10)')
+    args = parser.parse_args()
+    args.sizes = [int(size) for size in args.sizes.split(',')]
+    args.flows = [flow for flow in args.flows.split(',') if flow]
+    unknown = set(args.flows) - set(FLOWS)
+    if unknown:
+        parser.error(f'unknown flows: {", ".join(sorted(unknown))}')
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    results = run_benchmarks(args)
+    report = {
+        'created': datetime.now(timezone.utc).isoformat(),
+        'python': sys.version.split()[0],
+        'config': {k: v for k, v in vars(args).items() if k not in ('output', 'baseline')},
+        'peak_rss_mb': peak_rss_mb(),
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    logger.info(f'Results written to {args.output}')
+
+    if args.baseline and compare_with_baseline(results, args.baseline, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# SQLite file holding cached completions
+LLM_CACHE_PATH = os.getenv('LLM_CACHE_PATH', 'llm_cache.sqlite')
+# Total size of cached completion text before least recently used entries are evicted
+LLM_CACHE_MAX_MB = float(os.getenv('LLM_CACHE_MAX_MB', '50'))
+# Number of prompts packed into one Completions request in batch mode
+LLM_BATCH_SIZE = int(os.getenv('LLM_BATCH_SIZE', '20'))
+# Seconds before a cache hit refreshes the entry's last use time again
+LLM_CACHE_TOUCH_INTERVAL = float(os.getenv('LLM_CACHE_TOUCH_INTERVAL', '300'))
+# Number of pending last use updates written in one transaction
+TOUCH_BATCH_SIZE = 100
+
+
+# Prompts that differ only in case or whitespace share a cache entry
+def normalize_prompt(prompt):
+    return re.sub(r'\s+', ' ', prompt or '').strip().lower()
+
+
+# Cache key: hash of the normalized prompt together with the model and parameters
+def cache_key(prompt, model, **params):
+    material = json.dumps({'prompt': normalize_prompt(prompt), 'model': model, 'params': params},
+                          sort_keys=True)
+    return hashlib.sha256(material.encode()).hexdigest()
+
+
+# Persistent, content-addressed completion cache stored in SQLite.
+# Entries carry their size and last use time; once the total size goes over
+# max_bytes the least recently used entries are deleted until it is back under
+# 90% of the limit, so eviction does not run on every insert.
+# A hit does not write to the database: the last use time is only refreshed when it
+# is older than touch_interval, and those refreshes are collected and written in
+# batches (or with the next put / eviction), so lookups stay read-only.
+class CompletionCache:
+    def __init__(self, path=LLM_CACHE_PATH, max_bytes=int(LLM_CACHE_MAX_MB * 1024 * 1024),
+                 touch_interval=LLM_CACHE_TOUCH_INTERVAL):
+        self.max_bytes = max_bytes
+        self.touch_interval = touch_interval
+        self.touched = {}
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('''CREATE TABLE IF NOT EXISTS completions (
+                               key TEXT PRIMARY KEY,
+                               text TEXT NOT NULL,
+                               size INTEGER NOT NULL,
+                               last_used REAL NOT NULL)''')
+        self.db.execute('CREATE INDEX IF NOT EXISTS completions_last_used ON completions (last_used)')
+        self.db.commit()
+        self.total_bytes = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM completions').fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            row = self.db.execute('SELECT text, last_used FROM completions WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            now = time.time()
+            if now - row[1] > self.touch_interval:
+                self.touched[key] = now
+                if len(self.touched) >= TOUCH_BATCH_SIZE:
+                    self.write_touched()
+                    self.db.commit()
+            return row[0]
+
+    # Write the pending last use updates; the caller holds the lock and commits
+    def write_touched(self):
+        if self.touched:
+            self.db.executemany('UPDATE completions SET last_used = ? WHERE key = ?',
+                                [(used, key) for key, used in self.touched.items()])
+            self.touched.clear()
+
+    def put(self, key, text):
+        size = len(text.encode())
+        with self.lock:
+            self.touched.pop(key, None)
+            self.write_touched()
+            old = self.db.execute('SELECT size FROM completions WHERE key = ?', (key,)).fetchone()
+            self.db.execute('INSERT OR REPLACE INTO completions (key, text, size, last_used) VALUES (?, ?, ?, ?)',
+                            (key, text, size, time.time()))
+            self.total_bytes += size - (old[0] if old else 0)
+            if self.total_bytes > self.max_bytes:
+                self.evict(int(self.max_bytes * 0.9))
+            self.db.commit()
+
+    def evict(self, target_bytes):
+        stale = []
+        for key, size in self.db.execute('SELECT key, size FROM completions ORDER BY last_used'):
+            if self.total_bytes <= target_bytes:
+                break
+            stale.append((key,))
+            self.total_bytes -= size
+        self.db.executemany('DELETE FROM completions WHERE key = ?', stale)
+        logger.info(f'Evicted {len(stale)} cached completions')
+
+    def clear(self):
+        with self.lock:
+            self.touched.clear()
+            self.db.execute('DELETE FROM completions')
+            self.db.commit()
+            self.total_bytes = 0
+
+    def close(self):
+        with self.lock:
+            self.write_touched()
+            self.db.commit()
+            self.db.close()
+
+
+# Shared cache used by the scripts
+completion_cache = CompletionCache()
+
+
+# Function to complete many prompts at once: cached prompts are answered locally and
+# the remaining distinct prompts are packed into batched Completions requests, with
+# each choice mapped back to its prompt by choice.index.
+# Returns the completion texts in the same order as prompts.
+def complete_many(client, prompts, model, batch_size=LLM_BATCH_SIZE, cache=completion_cache, **params):
+    keys = [cache_key(prompt, model, **params) for prompt in prompts]
+    texts = {}
+    uncached = {}
+    for key, prompt in zip(keys, prompts):
+        if key in texts or key in uncached:
+            continue
+        text = cache.get(key)
+        if text is None:
+            uncached[key] = prompt
+        else:
+            texts[key] = text
+
+    pending = list(uncached.items())
+    for start in range(0, len(pending), batch_size):
+        chunk = pending[start:start + batch_size]
+        with metrics.stage('llm_generation'):
+            response = client.completions.create(model=model, prompt=[prompt for _, prompt in chunk], **params)
+        metrics.record_completion(model, response)
+        for choice in response.choices:
+            key = chunk[choice.index][0]
+            text = choice.text.strip()
+            texts[key] = text
+            cache.put(key, text)
+    return [texts.get(key) for key in keys]
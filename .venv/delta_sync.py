@@ -0,0 +1,210 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+from servicenow_api import INCIDENT_API_ENDPOINT, INCIDENT_FIELDS, PAGE_SIZE, fetch_page, keyset_query
+
+logger = logging.getLogger(__name__)
+
+# SQLite file holding the sync watermark and the processed-incident index
+SYNC_DB_PATH = os.getenv('SYNC_DB_PATH', 'sync_state.sqlite')
+# Index entries for incidents not processed for this many days are dropped
+SYNC_RETENTION_DAYS = int(os.getenv('SYNC_RETENTION_DAYS', '30'))
+# Incidents handled between commits of the sync state (and flushes of batched writes)
+SYNC_CHECKPOINT_SIZE = int(os.getenv('SYNC_CHECKPOINT_SIZE', '500'))
+
+# Incident fields whose change makes the bot act on an incident again.
+# Anything else (work notes, comments, sys_ fields) does not.
+RELEVANT_FIELDS = [
+    'state',
+    'priority',
+    'short_description',
+    'description',
+    'assignment_group',
+    'assigned_to',
+]
+
+SYNC_FIELDS = INCIDENT_FIELDS + ['sys_updated_on']
+
+
+# Hash of the relevant fields of an incident, optionally with a pending update applied
+def fingerprint(incident, update=None):
+    fields = {field: str(incident.get(field) or '') for field in RELEVANT_FIELDS}
+    for field, value in (update or {}).items():
+        if field in fields:
+            fields[field] = str(value)
+    return hashlib.sha256(json.dumps(fields, sort_keys=True).encode()).hexdigest()
+
+
+# Persisted sync state: the sys_updated_on watermark plus, per incident sys_id, the
+# update time, relevant-field fingerprint and action of the last time we acted on it
+class SyncState:
+    def __init__(self, path=SYNC_DB_PATH):
+        self.db = sqlite3.connect(path)
+        self.db.execute('CREATE TABLE IF NOT EXISTS watermark (name TEXT PRIMARY KEY, value TEXT NOT NULL)')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS incidents (
+                               sys_id TEXT PRIMARY KEY,
+                               updated_on TEXT NOT NULL,
+                               fingerprint TEXT NOT NULL,
+                               action TEXT NOT NULL,
+                               processed_at REAL NOT NULL)''')
+        self.db.commit()
+
+    def get_watermark(self, name='incident'):
+        row = self.db.execute('SELECT value FROM watermark WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else None
+
+    def set_watermark(self, value, name='incident'):
+        self.db.execute('INSERT OR REPLACE INTO watermark (name, value) VALUES (?, ?)', (name, value))
+        self.db.commit()
+
+    def get(self, sys_id):
+        row = self.db.execute('SELECT updated_on, fingerprint, action FROM incidents WHERE sys_id = ?',
+                              (sys_id,)).fetchone()
+        return dict(zip(('updated_on', 'fingerprint', 'action'), row)) if row else None
+
+    def record(self, sys_id, updated_on, fingerprint, action):
+        self.db.execute('INSERT OR REPLACE INTO incidents (sys_id, updated_on, fingerprint, action, processed_at) '
+                        'VALUES (?, ?, ?, ?, ?)', (sys_id, updated_on, fingerprint, action, time.time()))
+
+    def forget(self, sys_id):
+        self.db.execute('DELETE FROM incidents WHERE sys_id = ?', (sys_id,))
+
+    def prune(self, retention_days=SYNC_RETENTION_DAYS):
+        cutoff = time.time() - retention_days * 86400
+        self.db.execute('DELETE FROM incidents WHERE processed_at < ?', (cutoff,))
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+
+# Generator over the active incidents updated since the watermark, oldest first.
+# Pages are keyed on (sys_updated_on, sys_id) instead of an offset, so only one page
+# is held at a time and our own PATCHes, which bump sys_updated_on, only move those
+# incidents to the end of the stream instead of shifting the pages under us. When a
+# page ends inside a run of records saved in the same second, the rest of that
+# second is read with keyset paging on sys_id before moving past it.
+# >= is used so records saved in the same second as the watermark are not missed;
+# those are filtered out again by their fingerprint.
+def iter_changed_incidents(watermark, page_size=None):
+    page_size = page_size or PAGE_SIZE
+    condition = f'sys_updated_on>={watermark}' if watermark else ''
+    while True:
+        query = '^'.join(part for part in ('active=true', condition) if part)
+        page = fetch_page(INCIDENT_API_ENDPOINT, query + '^ORDERBYsys_updated_on^ORDERBYsys_id',
+                          SYNC_FIELDS, page_size, stage='fetch')
+        yield from page
+        if len(page) < page_size:
+            return
+        last_updated = page[-1].get('sys_updated_on') or ''
+        last_key = page[-1].get('sys_id')
+        while True:
+            same_second = fetch_page(INCIDENT_API_ENDPOINT,
+                                     keyset_query(f'active=true^sys_updated_on={last_updated}', last_key),
+                                     SYNC_FIELDS, page_size, stage='fetch')
+            yield from same_second
+            if len(same_second) < page_size:
+                break
+            last_key = same_second[-1].get('sys_id')
+        condition = f'sys_updated_on>{last_updated}'
+
+
+# Function to run one incremental sync cycle.
+# plan(incident) returns (update, action): the fields the bot will write and a short
+# label for what it does. act(incident) performs it and returns True on success; an
+# exception from act counts as a failure too.
+# With a BatchWriter, act only queues the writes; the writer is flushed here every
+# checkpoint_every incidents and incidents whose PATCH failed are treated like a
+# failed act.
+# Incidents whose relevant fields are unchanged since we last acted are skipped, and
+# the watermark never moves past an incident we failed on, so it is retried.
+# The index and watermark are committed at every checkpoint and before an exception
+# propagates, so a rerun does not act on the same incidents again.
+# Returns (processed, skipped).
+def sync_incidents(state, plan, act, writer=None, page_size=None, checkpoint_every=None):
+    checkpoint_every = checkpoint_every or SYNC_CHECKPOINT_SIZE
+    watermark = state.get_watermark()
+    logger.info(f'Syncing incidents changed since {watermark or "the beginning"}')
+
+    skipped = 0
+    failed_at = []
+    acted = {}
+    failed = set()
+    # Incidents whose writes are queued in the writer but not flushed yet
+    queued = []
+
+    def fail(sys_id, updated_on):
+        state.forget(sys_id)
+        failed.add(sys_id)
+        failed_at.append(updated_on)
+
+    # Function to flush the queued writes, then store the index and a watermark that
+    # does not move past any incident we failed on or have not confirmed yet
+    def checkpoint():
+        if writer is not None and queued:
+            try:
+                results = writer.flush()
+            except Exception:
+                # Nothing tells us which of the queued writes went through
+                for sys_id in queued:
+                    fail(sys_id, acted.pop(sys_id))
+                queued.clear()
+                state.set_watermark(min(failed_at))
+                state.commit()
+                raise
+            for result in results:
+                if not result['ok'] and result['sys_id'] in acted:
+                    fail(result['sys_id'], acted.pop(result['sys_id']))
+            queued.clear()
+        safe = min(failed_at) if failed_at else watermark
+        if safe:
+            state.set_watermark(safe)
+        state.commit()
+
+    since_checkpoint = 0
+    try:
+        for incident in iter_changed_incidents(watermark, page_size):
+            sys_id = incident.get('sys_id')
+            # Incidents we wrote to earlier in this cycle come round again at the end
+            if sys_id in acted or sys_id in failed:
+                continue
+            updated_on = incident.get('sys_updated_on') or ''
+            if updated_on > (watermark or ''):
+                watermark = updated_on
+            previous = state.get(sys_id)
+            if previous and previous['fingerprint'] == fingerprint(incident):
+                skipped += 1
+                continue
+            update, action = plan(incident)
+            try:
+                ok = act(incident)
+            except Exception as e:
+                logger.error(f'Error processing incident {incident.get("number") or sys_id}: {str(e)}')
+                ok = False
+            if ok:
+                # Store the fingerprint as it will be after our own update, so the
+                # change we make ourselves does not trigger another action next cycle
+                state.record(sys_id, updated_on, fingerprint(incident, update), action)
+                acted[sys_id] = updated_on
+                if writer is not None:
+                    queued.append(sys_id)
+            else:
+                failed.add(sys_id)
+                failed_at.append(updated_on)
+            since_checkpoint += 1
+            if since_checkpoint >= checkpoint_every:
+                checkpoint()
+                since_checkpoint = 0
+    finally:
+        checkpoint()
+
+    state.prune()
+    state.commit()
+    logger.info(f'Sync cycle: {len(acted)} incidents processed, {skipped} unchanged skipped, '
+                f'{len(failed_at)} failed')
+    return len(acted), skipped
@@ -0,0 +1,289 @@
+import os
+import json
+import time
+import atexit
+import bisect
+import logging
+import threading
+import contextlib
+from urllib.parse import urlparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Port of the Prometheus /metrics endpoint (0 disables it)
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+# File the metrics are dumped to as JSON every METRICS_DUMP_INTERVAL seconds and at exit
+METRICS_JSON_PATH = os.getenv('METRICS_JSON_PATH', '')
+METRICS_DUMP_INTERVAL = float(os.getenv('METRICS_DUMP_INTERVAL', '60'))
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, float('inf'))
+
+# Stages of handling an incident, in the order they happen
+STAGES = ['fetch', 'reference_lookup', 'llm_generation', 'comment_write', 'state_write',
+          'resolve_close', 'batch_write']
+
+HELP = {
+    'incident_bot_stage_seconds': ('histogram', 'Time spent per call in each stage'),
+    'incident_bot_stage_errors_total': ('counter', 'Calls of a stage that raised an exception'),
+    'servicenow_requests_total': ('counter', 'ServiceNow requests by endpoint and status code'),
+    'servicenow_request_errors_total': ('counter', 'ServiceNow requests that failed or returned an error status'),
+    'servicenow_request_seconds': ('histogram', 'ServiceNow request latency'),
+    'servicenow_retries_total': ('counter', 'ServiceNow requests retried, by reason'),
+    'openai_requests_total': ('counter', 'OpenAI completion requests'),
+    'openai_tokens_total': ('counter', 'OpenAI tokens used, from response.usage'),
+}
+
+
+# Function to turn a request URL into a low-cardinality endpoint label,
+# e.g. .../api/now/table/incident/<sys_id> -> table/incident
+def endpoint_label(url):
+    parts = [part for part in urlparse(str(url)).path.split('/') if part]
+    if parts[:2] == ['api', 'now']:
+        parts = parts[2:]
+    if parts and parts[0] == 'table':
+        parts = parts[:2]
+    return '/'.join(parts)
+
+
+# Latency histogram with cumulative Prometheus-style buckets
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    # Upper bound of the bucket holding the given quantile
+    def quantile(self, fraction):
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 6),
+            'max': round(self.max, 6),
+            'p50': self.quantile(0.50),
+            'p99': self.quantile(0.99),
+            'buckets': {('+Inf' if bound == float('inf') else str(bound)): count
+                        for bound, count in zip(self.buckets, self.counts)},
+        }
+
+
+# In-process registry of counters and histograms, keyed by name and labels.
+# Shared by all threads; every update takes the lock, which costs far less than the
+# HTTP calls being measured.
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.started = time.time()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    # Context manager timing one call of a stage
+    @contextlib.contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.inc('incident_bot_stage_errors_total', stage=name)
+            raise
+        finally:
+            self.observe('incident_bot_stage_seconds', time.perf_counter() - started, stage=name)
+
+    # Function to record one ServiceNow HTTP attempt; status is 'error' when no response came back
+    def record_request(self, method, url, status, seconds=None):
+        endpoint = endpoint_label(url)
+        self.inc('servicenow_requests_total', method=method, endpoint=endpoint, status=str(status))
+        if status == 'error' or int(status) >= 400:
+            self.inc('servicenow_request_errors_total', method=method, endpoint=endpoint, status=str(status))
+        if seconds is not None:
+            self.observe('servicenow_request_seconds', seconds, method=method, endpoint=endpoint)
+
+    def record_retry(self, method, url, reason):
+        self.inc('servicenow_retries_total', method=method, endpoint=endpoint_label(url), reason=str(reason))
+
+    # Function to record an OpenAI completion response and its token usage
+    def record_completion(self, model, response):
+        self.inc('openai_requests_total', model=model)
+        usage = getattr(response, 'usage', None)
+        if usage is None:
+            return
+        self.inc('openai_tokens_total', usage.prompt_tokens or 0, model=model, type='prompt')
+        self.inc('openai_tokens_total', usage.completion_tokens or 0, model=model, type='completion')
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+            self.started = time.time()
+
+    # Sum of a counter over every label set matching the given labels
+    def total(self, name, **labels):
+        wanted = set(labels.items())
+        with self.lock:
+            return sum(value for (counter, key), value in self.counters.items()
+                       if counter == name and wanted <= set(key))
+
+    def snapshot(self):
+        with self.lock:
+            counters = [{'name': name, 'labels': dict(labels), 'value': value}
+                        for (name, labels), value in sorted(self.counters.items())]
+            histograms = [{'name': name, 'labels': dict(labels), **histogram.as_dict()}
+                          for (name, labels), histogram in sorted(self.histograms.items())]
+        return {'started': self.started, 'time': time.time(), 'counters': counters, 'histograms': histograms}
+
+    # Metrics in the Prometheus text exposition format
+    def prometheus(self):
+        lines = []
+        described = set()
+
+        def describe(name):
+            if name in described:
+                return
+            described.add(name)
+            kind, text = HELP.get(name, ('untyped', name))
+            lines.append(f'# HELP {name} {text}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        with self.lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                describe(name)
+                lines.append(f'{name}{format_labels(labels)} {value}')
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                describe(name)
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'{name}_bucket{format_labels(labels + (("le", le),))} {cumulative}')
+                lines.append(f'{name}_sum{format_labels(labels)} {histogram.sum}')
+                lines.append(f'{name}_count{format_labels(labels)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def dump_json(self, path):
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(self.snapshot(), f, indent=2)
+        os.replace(temp_path, path)
+
+    # Function to build the --profile report: where the wall time of a run went
+    def profile_summary(self, wall):
+        with self.lock:
+            stages = {dict(labels)['stage']: histogram for (name, labels), histogram in self.histograms.items()
+                      if name == 'incident_bot_stage_seconds'}
+        lines = [f'Profile: {wall:.2f}s wall time',
+                 f'{"stage":<18}{"calls":>8}{"total s":>10}{"% wall":>8}{"avg ms":>10}{"p99 ms":>10}{"max ms":>10}']
+        accounted = 0.0
+        for stage in STAGES + sorted(set(stages) - set(STAGES)):
+            histogram = stages.get(stage)
+            if histogram is None:
+                continue
+            accounted += histogram.sum
+            share = histogram.sum / wall * 100 if wall else 0.0
+            lines.append(f'{stage:<18}{histogram.count:>8}{histogram.sum:>10.2f}{share:>7.1f}%'
+                         f'{histogram.sum / histogram.count * 1000:>10.1f}'
+                         f'{histogram.quantile(0.99) * 1000:>10.1f}{histogram.max * 1000:>10.1f}')
+        lines.append(f'{"other":<18}{"":>8}{max(wall - accounted, 0.0):>10.2f}')
+        lines.append('(pages are prefetched in the background and the async pipeline runs stages concurrently, '
+                     'so stages can add up to more than the wall time)')
+        requests = self.total('servicenow_requests_total')
+        errors = self.total('servicenow_request_errors_total')
+        retries = self.total('servicenow_retries_total')
+        lines.append(f'ServiceNow: {requests} requests, {errors} errors, {retries} retries')
+        lines.append(f'OpenAI: {self.total("openai_requests_total")} requests, '
+                     f'{self.total("openai_tokens_total", type="prompt")} prompt tokens, '
+                     f'{self.total("openai_tokens_total", type="completion")} completion tokens')
+        return '\n'.join(lines)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for _, value in labels)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + '}'
+
+
+# Shared registry used by the scripts
+metrics = Metrics()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = metrics.prometheus().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Function to serve /metrics for Prometheus on a background thread
+def start_http_server(port=METRICS_PORT):
+    server = ThreadingHTTPServer(('', port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f'Serving metrics on http://localhost:{server.server_port}/metrics')
+    return server
+
+
+# Function to write the metrics to path every interval seconds, and once more at exit
+def start_json_dump(path=METRICS_JSON_PATH, interval=METRICS_DUMP_INTERVAL):
+    def dump():
+        try:
+            metrics.dump_json(path)
+        except OSError as e:
+            logger.error(f'Error writing metrics to {path}: {str(e)}')
+
+    def run():
+        while True:
+            time.sleep(interval)
+            dump()
+
+    if interval > 0:
+        threading.Thread(target=run, daemon=True).start()
+    atexit.register(dump)
+
+
+# Function to start whichever exporters are configured
+def start_exporters(port=METRICS_PORT, json_path=METRICS_JSON_PATH, interval=METRICS_DUMP_INTERVAL):
+    if port:
+        start_http_server(port)
+    if json_path:
+        start_json_dump(json_path, interval)
@@ -0,0 +1,348 @@
+import re
+import json
+import time
+import base64
+import random
+import bisect
+import logging
+import argparse
+import threading
+from datetime import datetime, timezone
+from collections import Counter
+from urllib.parse import urlsplit, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from synthetic_incidents import generate_incidents, sys_id, timestamp
+
+logger = logging.getLogger(__name__)
+
+TABLE_PATH = re.compile(r'^/api/now/table/(\w+)(?:/(\w+))?$')
+CONDITION = re.compile(r'^(\w+?)(>=|<=|!=|>|<|=|IN)(.*)$')
+# Incident states that make an incident inactive (Resolved, Closed, Canceled)
+INACTIVE_STATES = ('6', '7', '8')
+
+
+# Function to turn an encoded query (a subset of ServiceNow's syntax: field=value,
+# !=, >, >=, <, <=, IN, ^ for AND, ORDERBY / ORDERBYDESC) into filters and ordering
+def parse_query(query):
+    filters = []
+    order = []
+    for part in (query or '').split('^'):
+        if not part:
+            continue
+        if part.startswith('ORDERBYDESC'):
+            order.append((part[len('ORDERBYDESC'):], True))
+        elif part.startswith('ORDERBY'):
+            order.append((part[len('ORDERBY'):], False))
+        else:
+            match = CONDITION.match(part)
+            if not match:
+                raise ValueError(f'Unsupported query condition: {part}')
+            field, operator, value = match.groups()
+            filters.append((field, operator, value.split(',') if operator == 'IN' else value))
+    return filters, order
+
+
+def matches(record, filters):
+    for field, operator, value in filters:
+        actual = str(record.get(field, ''))
+        if operator == '=' and actual != value:
+            return False
+        if operator == '!=' and actual == value:
+            return False
+        if operator == '>' and not actual > value:
+            return False
+        if operator == '>=' and not actual >= value:
+            return False
+        if operator == '<' and not actual < value:
+            return False
+        if operator == '<=' and not actual <= value:
+            return False
+        if operator == 'IN' and actual not in value:
+            return False
+    return True
+
+
+# In-memory stand-in for the Table API tables the scripts use
+class MockInstance:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset(0)
+
+    def reset(self, incidents, seed=42):
+        incident_records, groups, users = generate_incidents(incidents, seed=seed)
+        with self.lock:
+            self.tables = {
+                'incident': {r['sys_id']: r for r in incident_records},
+                'sys_user_group': {r['sys_id']: r for r in groups},
+                'sys_user': {r['sys_id']: r for r in users},
+                'incident_resolution': {},
+            }
+            # Sorted sys_ids per table, so keyset pages on sys_id do not scan the table
+            self.keys = {table: sorted(records) for table, records in self.tables.items()}
+            self.rng = random.Random(seed)
+            self.journal = Counter()
+
+    def query(self, table, params):
+        filters, order = parse_query(params.get('sysparm_query'))
+        limit = int(params.get('sysparm_limit') or 10000)
+        offset = int(params.get('sysparm_offset') or 0)
+        fields = [f for f in (params.get('sysparm_fields') or '').split(',') if f]
+        records = self.tables.get(table, {})
+        with self.lock:
+            if order in ([], [('sys_id', False)]):
+                # Walk the sorted keys from the first candidate until the page is full
+                keys = self.keys[table]
+                start = 0
+                for field, operator, value in filters:
+                    if field == 'sys_id' and operator in ('>', '>='):
+                        search = bisect.bisect_right if operator == '>' else bisect.bisect_left
+                        start = max(start, search(keys, value))
+                page = []
+                for key in keys[start:] if start else keys:
+                    record = records[key]
+                    if matches(record, filters):
+                        if offset:
+                            offset -= 1
+                            continue
+                        page.append(record)
+                        if len(page) == limit:
+                            break
+            else:
+                selected = [r for r in records.values() if matches(r, filters)]
+                for field, descending in reversed(order):
+                    selected.sort(key=lambda r: str(r.get(field, '')), reverse=descending)
+                page = selected[offset:offset + limit]
+            if fields:
+                page = [{f: record.get(f, '') for f in fields} for record in page]
+            else:
+                page = [dict(record) for record in page]
+        return page
+
+    def update(self, table, key, body):
+        with self.lock:
+            record = self.tables.get(table, {}).get(key)
+            if record is None:
+                return None
+            for field, value in body.items():
+                if field in ('comments', 'work_notes'):
+                    self.journal[field] += 1
+                    continue
+                record[field] = str(value)
+            # Like the instance, resolving or closing an incident makes it inactive
+            if table == 'incident' and 'state' in body:
+                record['active'] = 'false' if record['state'] in INACTIVE_STATES else 'true'
+            record['sys_updated_on'] = timestamp(datetime.now(timezone.utc))
+            return dict(record)
+
+    def insert(self, table, body):
+        record = {field: str(value) for field, value in body.items()}
+        with self.lock:
+            record['sys_id'] = sys_id(self.rng)
+            record['sys_updated_on'] = timestamp(datetime.now(timezone.utc))
+            self.tables.setdefault(table, {})[record['sys_id']] = record
+            bisect.insort(self.keys.setdefault(table, []), record['sys_id'])
+        return dict(record)
+
+
+# Settings for the fake OpenAI completions endpoint and injected ServiceNow faults
+class FaultSettings:
+    def __init__(self, llm_latency_ms=200.0, llm_error_rate=0.0, llm_429_rate=0.0,
+                 sn_latency_ms=0.0, sn_429_rate=0.0):
+        self.llm_latency_ms = llm_latency_ms
+        self.llm_error_rate = llm_error_rate
+        self.llm_429_rate = llm_429_rate
+        self.sn_latency_ms = sn_latency_ms
+        self.sn_429_rate = sn_429_rate
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Send headers and body in one segment and skip Nagle's algorithm; otherwise
+    # keep-alive clients stall on delayed ACKs for ~40ms per request
+    wbufsize = 64 * 1024
+    disable_nagle_algorithm = True
+    instance = None
+    faults = None
+    stats = None
+    stats_lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def count(self, key, status):
+        with self.stats_lock:
+            self.stats['requests'][key] += 1
+            self.stats['status'][f'{key} {status}'] += 1
+
+    def send_json(self, status, body, key, extra_headers=None):
+        self.count(key, status)
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (extra_headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}') if length else {}
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_PATCH(self):
+        self.dispatch('PATCH')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def dispatch(self, method):
+        url = urlsplit(self.path)
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        body = self.read_body() if method in ('PATCH', 'POST') else None
+
+        if url.path == '/mock/stats':
+            return self.send_json(200, self.snapshot_stats(), 'mock')
+        if url.path == '/mock/reset':
+            self.instance.reset(int(body.get('incidents', 0)), int(body.get('seed', 42)))
+            with self.stats_lock:
+                self.stats['requests'].clear()
+                self.stats['status'].clear()
+            return self.send_json(200, {'incidents': len(self.instance.tables['incident'])}, 'mock')
+        if url.path == '/v1/completions' and method == 'POST':
+            return self.completions(body)
+        if url.path == '/api/now/v1/batch' and method == 'POST':
+            return self.batch(body)
+
+        if self.faults.sn_latency_ms:
+            time.sleep(self.faults.sn_latency_ms / 1000.0)
+        match = TABLE_PATH.match(url.path)
+        table = match.group(1) if match else 'unknown'
+        key = f'{method} {table}'
+        if self.faults.sn_429_rate and random.random() < self.faults.sn_429_rate:
+            return self.send_json(429, {'error': {'message': 'Too many requests'}}, key, {'Retry-After': '1'})
+        status, result = self.table_api(method, url.path, params, body)
+        self.send_json(status, result, key)
+
+    # Function to serve a Table API request; also used for Batch API sub-requests
+    def table_api(self, method, path, params, body):
+        match = TABLE_PATH.match(path)
+        if not match:
+            return 404, {'error': {'message': 'Invalid table'}}
+        table, key = match.groups()
+        if method == 'GET' and key is None:
+            try:
+                return 200, {'result': self.instance.query(table, params)}
+            except ValueError as e:
+                return 400, {'error': {'message': str(e)}}
+        if method == 'PATCH' and key:
+            record = self.instance.update(table, key, body or {})
+            if record is None:
+                return 404, {'error': {'message': 'No Record found'}}
+            return 200, {'result': record}
+        if method == 'POST' and key is None:
+            return 201, {'result': self.instance.insert(table, body or {})}
+        return 405, {'error': {'message': 'Method not supported'}}
+
+    def batch(self, body):
+        serviced = []
+        for sub in body.get('rest_requests', []):
+            url = urlsplit(sub.get('url', ''))
+            params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+            sub_body = json.loads(base64.b64decode(sub['body'])) if sub.get('body') else None
+            status, result = self.table_api(sub.get('method', 'GET'), url.path, params, sub_body)
+            match = TABLE_PATH.match(url.path)
+            self.count(f'batched {sub.get("method")} {match.group(1) if match else "unknown"}', status)
+            serviced.append({
+                'id': sub.get('id'),
+                'status_code': status,
+                'body': base64.b64encode(json.dumps(result).encode()).decode(),
+            })
+        self.send_json(200, {'batch_request_id': body.get('batch_request_id'),
+                             'serviced_requests': serviced, 'unserviced_requests': []}, 'POST batch')
+
+    def completions(self, body):
+        key = 'POST completions'
+        faults = self.faults
+        if faults.llm_latency_ms:
+            # Latency varies +/- 50% around the configured mean
+            time.sleep(faults.llm_latency_ms * random.uniform(0.5, 1.5) / 1000.0)
+        roll = random.random()
+        if roll < faults.llm_429_rate:
+            return self.send_json(429, {'error': {'message': 'Rate limit reached', 'type': 'requests'}},
+                                  key, {'Retry-After': '1'})
+        if roll < faults.llm_429_rate + faults.llm_error_rate:
+            return self.send_json(500, {'error': {'message': 'The server had an error', 'type': 'server_error'}}, key)
+
+        prompts = body.get('prompt')
+        prompts = prompts if isinstance(prompts, list) else [prompts]
+        max_tokens = int(body.get('max_tokens') or 16)
+        choices = []
+        prompt_tokens = 0
+        completion_tokens = 0
+        for index, prompt in enumerate(prompts):
+            words = str(prompt).split()
+            text = ' We are looking into: ' + ' '.join(words[:max(1, min(len(words), max_tokens // 2))])
+            prompt_tokens += len(words)
+            completion_tokens += len(text.split())
+            choices.append({'text': text, 'index': index, 'logprobs': None, 'finish_reason': 'stop'})
+        self.send_json(200, {
+            'id': f'cmpl-mock-{random.getrandbits(32):08x}',
+            'object': 'text_completion',
+            'created': int(time.time()),
+            'model': body.get('model'),
+            'choices': choices,
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                      'total_tokens': prompt_tokens + completion_tokens},
+        }, key)
+
+    def snapshot_stats(self):
+        with self.stats_lock:
+            return {
+                'requests': dict(self.stats['requests']),
+                'status': dict(self.stats['status']),
+                'journal': dict(self.instance.journal),
+            }
+
+
+# Function to create (but not start) a mock server; port 0 picks a free port
+def create_server(port=0, incidents=0, seed=42, faults=None):
+    instance = MockInstance()
+    instance.reset(incidents, seed)
+    handler = type('BoundMockHandler', (MockHandler,), {
+        'instance': instance,
+        'faults': faults or FaultSettings(),
+        'stats': {'requests': Counter(), 'status': Counter()},
+    })
+    return ThreadingHTTPServer(('127.0.0.1', port), handler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for the ServiceNow Table/Batch API and OpenAI completions')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--incidents', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--llm-latency-ms', type=float, default=200.0)
+    parser.add_argument('--llm-error-rate', type=float, default=0.0)
+    parser.add_argument('--llm-429-rate', type=float, default=0.0)
+    parser.add_argument('--sn-latency-ms', type=float, default=0.0)
+    parser.add_argument('--sn-429-rate', type=float, default=0.0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    faults = FaultSettings(args.llm_latency_ms, args.llm_error_rate, args.llm_429_rate,
+                           args.sn_latency_ms, args.sn_429_rate)
+    server = create_server(args.port, args.incidents, args.seed, faults)
+    logger.info(f'Mock ServiceNow/OpenAI listening on http://127.0.0.1:{server.server_port} '
+                f'with {args.incidents} incidents')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
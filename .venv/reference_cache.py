@@ -0,0 +1,217 @@
+import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from servicenow_api import (ASSIGNMENT_GROUP_ENDPOINT, ASSIGNEE_ENDPOINT,
+                            fetch_page, iter_records, FetchError)
+
+logger = logging.getLogger(__name__)
+
+# Seconds before the cache asks ServiceNow for records changed since its watermark
+REF_CACHE_TTL = int(os.getenv('REF_CACHE_TTL', '900'))
+# Maximum number of records kept per table before least recently used ones are evicted
+REF_CACHE_SIZE = int(os.getenv('REF_CACHE_SIZE', '5000'))
+# Directory for on-disk snapshots so a restart starts warm; unset disables snapshots
+REF_CACHE_DIR = os.getenv('REF_CACHE_DIR')
+
+# Number of sys_ids sent in a single sys_idIN query, keeps the URL a sane length
+LOOKUP_CHUNK_SIZE = 100
+
+
+# In-memory cache of a ServiceNow reference table (groups, users) keyed on sys_id.
+# Records are evicted least recently used first once max_size is reached. Once the
+# TTL has passed, the next access pulls only the records whose sys_updated_on is
+# newer than the newest one already cached, instead of downloading the table again.
+class ReferenceCache:
+    def __init__(self, name, endpoint, fields, base_query='', ttl=REF_CACHE_TTL,
+                 max_size=REF_CACHE_SIZE, snapshot_dir=REF_CACHE_DIR):
+        self.name = name
+        self.endpoint = endpoint
+        self.fields = list(dict.fromkeys(['sys_id', 'sys_updated_on'] + list(fields)))
+        self.base_query = base_query
+        self.ttl = ttl
+        self.max_size = max_size
+        self.snapshot_path = os.path.join(snapshot_dir, f'{name}.json') if snapshot_dir else None
+        self.records = OrderedDict()
+        self.watermark = ''
+        self.refreshed_at = time.time()
+        # True while the cache holds every record matching base_query
+        self.complete = False
+        # True when records were added since the snapshot was last written
+        self.dirty = False
+        # Number of records evicted so far, to tell whether a full download fitted
+        self.evictions = 0
+        self.lock = threading.RLock()
+        self.load_snapshot()
+
+    def query(self, condition):
+        return '^'.join(part for part in (self.base_query, condition) if part)
+
+    def store(self, record):
+        sys_id = record.get('sys_id')
+        self.records[sys_id] = record
+        self.records.move_to_end(sys_id)
+        updated_on = record.get('sys_updated_on') or ''
+        if updated_on > self.watermark:
+            self.watermark = updated_on
+        while len(self.records) > self.max_size:
+            self.records.popitem(last=False)
+            self.evictions += 1
+            self.complete = False
+
+    # Pull records changed since the watermark once the TTL has expired
+    def refresh(self, force=False):
+        with self.lock:
+            if not force and time.time() - self.refreshed_at < self.ttl:
+                return
+            if self.watermark:
+                # >= so records saved in the same second as the watermark are not missed
+                condition = f'sys_updated_on>={self.watermark}^ORDERBYsys_updated_on'
+                for record in iter_records(self.endpoint, self.query(condition), self.fields,
+                                           keyset=False):
+                    self.store(record)
+            self.refreshed_at = time.time()
+            self.save_snapshot()
+
+    # All records of the table, downloaded once and then kept current by refresh().
+    # A table larger than max_size is downloaded again on every call instead of
+    # being served truncated from the cache.
+    def all(self):
+        with self.lock:
+            if not self.complete:
+                evictions = self.evictions
+                records = []
+                for record in iter_records(self.endpoint, self.base_query, self.fields):
+                    self.store(record)
+                    records.append(record)
+                self.complete = self.evictions == evictions
+                self.refreshed_at = time.time()
+                self.save_snapshot()
+                if not self.complete:
+                    logger.warning(f'{self.name} has more than {self.max_size} records, not caching the full table')
+                    return records
+            else:
+                self.refresh()
+            return list(self.records.values())
+
+    # Look up many sys_ids at once; misses are fetched with a single sys_idIN query per chunk.
+    # The snapshot is not rewritten here but on the next refresh or save_snapshots() call.
+    def get_many(self, sys_ids):
+        with self.lock:
+            self.refresh()
+            found = {}
+            missing = []
+            for sys_id in dict.fromkeys(sys_ids):
+                if not sys_id:
+                    continue
+                if sys_id in self.records:
+                    self.records.move_to_end(sys_id)
+                    found[sys_id] = self.records[sys_id]
+                else:
+                    missing.append(sys_id)
+            for i in range(0, len(missing), LOOKUP_CHUNK_SIZE):
+                chunk = missing[i:i + LOOKUP_CHUNK_SIZE]
+                page = fetch_page(self.endpoint, self.query('sys_idIN' + ','.join(chunk)),
+                                  self.fields, len(chunk))
+                for record in page:
+                    self.store(record)
+                    found[record.get('sys_id')] = record
+            if missing:
+                self.dirty = True
+            return found
+
+    def get(self, sys_id):
+        return self.get_many([sys_id]).get(sys_id)
+
+    # Drop everything cached in memory (the snapshot on disk is left alone)
+    def clear(self):
+        with self.lock:
+            self.records.clear()
+            self.watermark = ''
+            self.complete = False
+            self.refreshed_at = time.time()
+
+    def load_snapshot(self):
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return
+        try:
+            with open(self.snapshot_path) as f:
+                snapshot = json.load(f)
+            for record in snapshot.get('records', []):
+                self.store(record)
+            self.watermark = snapshot.get('watermark', self.watermark)
+            self.refreshed_at = snapshot.get('refreshed_at', 0)
+            self.complete = snapshot.get('complete', False) and self.evictions == 0
+            logger.info(f'Loaded {len(self.records)} {self.name} records from {self.snapshot_path}')
+        except (OSError, ValueError) as e:
+            logger.warning(f'Ignoring unreadable {self.name} snapshot: {str(e)}')
+
+    def save_snapshot(self):
+        self.dirty = False
+        if not self.snapshot_path:
+            return
+        snapshot = {
+            'watermark': self.watermark,
+            'refreshed_at': self.refreshed_at,
+            'complete': self.complete,
+            'records': list(self.records.values()),
+        }
+        tmp_path = self.snapshot_path + '.tmp'
+        try:
+            os.makedirs(os.path.dirname(self.snapshot_path) or '.', exist_ok=True)
+            with open(tmp_path, 'w') as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, self.snapshot_path)
+        except OSError as e:
+            logger.warning(f'Could not write {self.name} snapshot: {str(e)}')
+
+
+# Shared caches for the assignment group and user reference tables
+assignment_groups = ReferenceCache('assignment_groups', ASSIGNMENT_GROUP_ENDPOINT, ['name'],
+                                   base_query='type=assignment_group')
+users = ReferenceCache('users', ASSIGNEE_ENDPOINT, ['name', 'user_name'])
+
+
+# Function to write the snapshots of the shared caches that looked up new records,
+# called once at the end of a batch instead of on every lookup
+def save_snapshots():
+    for cache in (assignment_groups, users):
+        with cache.lock:
+            if cache.dirty:
+                cache.save_snapshot()
+
+
+# Reference fields are plain sys_ids when sysparm_exclude_reference_link is set,
+# otherwise a {'link': ..., 'value': ...} object
+def reference_value(field):
+    if isinstance(field, dict):
+        return field.get('value')
+    return field or None
+
+
+# Function to look up the referenced records of one field for a batch of incidents
+def lookup_names(cache, incidents, field):
+    try:
+        return cache.get_many(reference_value(i.get(field)) for i in incidents)
+    except FetchError as e:
+        logger.error(f'Could not look up {cache.name}: {str(e)}')
+        return {}
+
+
+# Function to resolve assignment_group / assigned_to sys_ids to display names for a
+# batch of incidents, using one bulk lookup per reference table.
+# The names are only for display, so a failed lookup leaves them empty.
+def resolve_reference_names(incidents):
+    groups = lookup_names(assignment_groups, incidents, 'assignment_group')
+    people = lookup_names(users, incidents, 'assigned_to')
+    names = {}
+    for incident in incidents:
+        group = groups.get(reference_value(incident.get('assignment_group')))
+        person = people.get(reference_value(incident.get('assigned_to')))
+        names[incident.get('sys_id')] = {
+            'assignment_group': group.get('name') if group else None,
+            'assigned_to': person.get('name') if person else None,
+        }
+    return names
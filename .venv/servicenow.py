@@ -0,0 +1,398 @@
+import os
+import time
+import logging
+import argparse
+from dotenv import load_dotenv
+from openai import OpenAI
+import openai
+import json
+from servicenow_api import INCIDENT_API_ENDPOINT, sn_client, iter_open_incidents
+from reference_cache import assignment_groups, resolve_reference_names, save_snapshots
+from batch_writer import BatchWriter, SN_BATCH_SIZE
+from completion_cache import completion_cache, cache_key, complete_many
+from delta_sync import SyncState, sync_incidents
+from triage import triage_engine
+from metrics import metrics, start_exporters, METRICS_PORT, METRICS_JSON_PATH
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+openai.api_key = os.getenv('OPENAI_API_KEY')
+gptModel = os.getenv('OPENAI_MODEL')
+client = OpenAI()
+
+# ServiceNow Instance credentials and endpoints are defined in servicenow_api
+logger.info('INCIDENT_API_ENDPOINT: ' + INCIDENT_API_ENDPOINT)
+
+# Initialize OpenAI client
+openai.api_key = os.getenv('OPENAI_API_KEY')
+
+# Function to fetch open incidents from ServiceNow.
+# Returns a generator that pages through the incident table, so callers iterate
+# over it instead of holding the whole result set in memory.
+def fetch_open_incidents(page_size=None):
+    return iter_open_incidents(page_size=page_size)
+
+# Function to extract field information from Service Now INCs.
+# reference_names are the display names from resolve_reference_names; callers working
+# through many incidents resolve them once per chunk and pass them in.
+def extract_field_info(incident, sys_id, writer=None, reference_names=None):
+    logger.debug("Extracting field information")
+    incNo = incident.get('number')
+    description = incident.get('description')
+    short_description = incident.get('short_description')
+    # Display all fields and their values
+    # logger.info("Incident Details:")
+    # for field, value in incident.items():
+    #     logger.info(f"{field}: {value}")
+
+    # Define a dictionary of mandatory fields and their display names
+    mandatory_fields = {
+        'number': 'Incident Number',
+        'short_description': 'Short Description',
+        'description': 'Description',
+        'state': 'State',
+        'priority': 'Priority',
+        'assignment_group': 'Assignment Group',
+        'assigned_to': 'Assigned To'
+    }
+    # Resolve the assignment group / assignee sys_ids to names for display
+    if reference_names is None:
+        with metrics.stage('reference_lookup'):
+            reference_names = resolve_reference_names([incident]).get(incident.get('sys_id'), {})
+
+    # Display mandatory fields and their values
+    for field, display_name in mandatory_fields.items():
+        if field in incident and incident[field]:
+            value = reference_names.get(field) or incident[field]
+            logger.info(f"{display_name}: {value}")
+        else:
+            logger.warning(f"Missing or empty value for mandatory field '{display_name}'.")
+    # Run the triage rules, then update incident state based on current state
+    decision, payload, needs_comment = triage_incident(incident)
+    if decision is not None:
+        logger.info(f'Incident {incNo} matched triage rule {decision.rule}')
+        if decision.action == 'resolve':
+            return resolve_incident(sys_id, writer, decision.close_notes)
+    if needs_comment or (decision is not None and decision.comment):
+        #Calling add_comment method to update the comments in INC
+        comment = decision.comment if decision is not None else None
+        if not add_comment(sys_id,incNo,description,short_description,writer,comment):
+            return False
+    #Calling update_incident_state method to update the INC status
+    return update_incident_state(sys_id, payload, writer)
+
+# Function to work out the state transition for an incident.
+# Returns the PATCH payload and whether an AI comment has to be added first.
+def get_state_payload(incState):
+    if incState in (1,3):  # New / On Hold state
+        # Construct payload for updating the state to In Progress
+        return {'state': 2}, False
+    elif incState == 2:  # In Progress state
+        # Construct payload for updating the state to On Hold
+        return {'state': 3}, True
+    return {}, False
+
+# Function to decide what happens to an incident before any LLM call.
+# Returns (decision, payload, needs_comment): the matched TriageDecision or None, the
+# state PATCH payload, and whether an LLM generated comment is still needed. Only
+# incidents that match no triage rule go to generate_text.
+def triage_incident(incident):
+    decision = triage_engine.classify(incident)
+    payload, needs_comment = get_state_payload(int(incident.get('state')))
+    if decision is None:
+        return None, payload, needs_comment
+    if decision.action == 'resolve':
+        return decision, {'state': '7'}, False
+    if decision.state is not None:
+        payload = {'state': decision.state}
+    return decision, payload, False
+
+# Function to list the assignment groups (name, sys_id).
+# Served from reference_cache, so the sys_user_group table is downloaded once and
+# afterwards only records changed since the last refresh are pulled.
+def get_assignment_group(sys_id):
+    try:
+        return [(group['name'], group['sys_id']) for group in assignment_groups.all()]
+    except Exception as e:
+        # Log any exceptions that occur during the request
+        logger.error(f"Error fetching assignment groups: {str(e)}")
+        return None
+
+# Function to update incident state.
+# With a BatchWriter the update is queued and sent later through the Batch API.
+def update_incident_state(incident_sys_id, payload, writer=None):
+    if writer is not None:
+        writer.queue_incident(incident_sys_id, payload)
+        return True
+    # Make a PATCH request to update the incident state
+    incident_url = f'{INCIDENT_API_ENDPOINT}/{incident_sys_id}'
+    with metrics.stage('state_write'):
+        response = sn_client.patch(incident_url, json=payload)
+    # Check if the request was successful (status code 200)
+    if response.status_code == 200:
+        logger.info(f'Incident state updated: {incident_sys_id}')
+        return True
+    else:
+        logger.error(f'Error updating incident state {incident_sys_id}: {response.status_code}')
+        return False
+
+                
+           # if assignedTo.empty:
+
+# Parameters sent with every completion request
+COMPLETION_PARAMS = {'max_tokens': 100, 'temperature': 0.7}
+
+# Function to build the completion prompt for an incident
+def comment_prompt(description, short_description):
+    return (description or '') + '\n' + (short_description or '')
+
+# Function to generate text using OpenAI's API.
+# Completions are cached on the normalized prompt, so duplicate incidents are free.
+def generate_text(description,short_description=''):
+    prompt = comment_prompt(description, short_description)
+    key = cache_key(prompt, gptModel, **COMPLETION_PARAMS)
+    text = completion_cache.get(key)
+    if text is None:
+        with metrics.stage('llm_generation'):
+            response = client.completions.create(
+                model=gptModel,
+                prompt=prompt,
+                **COMPLETION_PARAMS
+            )
+        metrics.record_completion(gptModel, response)
+        text = response.choices[0].text.strip()
+        completion_cache.put(key, text)
+    logger.info("Comments: " + text)
+    return text
+
+# Function to generate the comments for a chunk of incidents in batched
+# Completions requests, so the per-incident generate_text calls hit the cache
+def prefetch_comments(incidents):
+    prompts = [
+        comment_prompt(incident.get('description'), incident.get('short_description'))
+        for incident in incidents
+        if triage_incident(incident)[2]
+    ]
+    if prompts:
+        complete_many(client, prompts, gptModel, **COMPLETION_PARAMS)
+
+def add_comment(incident_sys_id, incident_no,description,short_description, writer=None, comment=None):
+    # Generate comment using OpenAI, unless a canned comment was given
+    if comment is None:
+        comment = generate_text(description,short_description)
+
+    # Construct payload for adding a comment
+    payload = {
+        'comments': comment,
+        'incident': incident_sys_id
+    }
+    if writer is not None:
+        writer.queue_incident(incident_sys_id, payload)
+        return True
+
+    # Make a patch request to add the comment
+    incident_url = f'{INCIDENT_API_ENDPOINT}/{incident_sys_id}'
+    with metrics.stage('comment_write'):
+        response = sn_client.patch(incident_url, json=payload)
+    logger.info(f'Incident#: {incident_no}')
+    # Check if the request was successful (status code 200)
+    if response.status_code == 200:
+        logger.info(f'Comment added to incident: {incident_sys_id}')
+        return True
+    else:
+        logger.error(f'Error adding comment to incident {incident_sys_id}: {response.status_code}')
+        return False
+
+# Function to resolve an incident
+def resolve_incident(incident_sys_id, writer=None, resolution_notes=None):
+    if resolution_notes is None:
+        resolution_notes = generate_text("Resolution notes for incident with sys_id: " + incident_sys_id)
+    payload = {
+        'close_code': 'Resolved by request',
+        'close_notes': resolution_notes,
+        'state': '6',  # Resolved state
+    }
+    cPayload = {
+        'state': '7'  # Closed state
+    }
+    if writer is not None:
+        # Resolve and close are two PATCHes; the writer keeps them in order
+        writer.queue_incident(incident_sys_id, payload)
+        writer.queue_incident(incident_sys_id, cPayload)
+        return True
+    resolve_url = f'{INCIDENT_API_ENDPOINT}/{incident_sys_id}'
+    with metrics.stage('resolve_close'):
+        response = sn_client.patch(resolve_url, json=payload)  # Use PATCH method for updating the incident
+    if response.status_code == 200:
+        logger.info(f'Incident resolved: {incident_sys_id}')
+        with metrics.stage('resolve_close'):
+            response = sn_client.patch(resolve_url, json=cPayload)
+        if response.status_code == 200:
+            logger.info(f'Incident closed: {incident_sys_id}')
+            return True
+        else:
+            logger.error(f'Error closing incident {incident_sys_id}: {response.status_code}')
+            logger.error(response.text)  # Log the response content for debugging
+    else:
+        logger.error(f'Error resolving incident {incident_sys_id}: {response.status_code}')
+        logger.error(response.text)  # Log the response content for debugging
+    return False
+
+
+# def read_incident_details():
+#     # Fetch open incidents from ServiceNow
+#     open_incidents = fetch_open_incidents()
+    
+#     if open_incidents:
+#         # Select the first open incident
+#         first_incident = open_incidents[0]
+        
+#         # Display all fields and their values
+#         logger.info("Incident Details:")
+#         for field, value in first_incident.items():
+#             logger.info(f"{field}: {value}")
+
+#         # Define a dictionary of mandatory fields and their display names
+#         mandatory_fields = {
+#             'number': 'Incident Number',
+#             'short_description': 'Short Description',
+#             'state': 'State',
+#             'priority': 'Priority',
+#             'assignment_group': 'Assignment Group'
+#         }
+        
+#         # Display mandatory fields and their values
+#         logger.info("Mandatory Incident Fields:")
+#         for field, display_name in mandatory_fields.items():
+#             if field in first_incident and first_incident[field]:
+#                 value = first_incident[field]
+#                 logger.info(f"{display_name}: {value}")
+#             else:
+#                 logger.warning(f"Missing or empty value for mandatory field '{display_name}'.")
+#     else:
+#         logger.info('No open incidents found.')
+
+
+
+# Function to run extract_field_info over a chunk of incidents after resolving their
+# reference names and generating their comments in one go
+def process_chunk(incidents, writer):
+    with metrics.stage('reference_lookup'):
+        names = resolve_reference_names(incidents)
+    prefetch_comments(incidents)
+    for incident in incidents:
+        sys_id = incident.get('sys_id')
+        extract_field_info(incident, sys_id, writer, names.get(sys_id, {}))
+    return len(incidents)
+
+# Function to process every open incident, queuing the writes and sending them
+# through the Batch API in chunks instead of one PATCH per update
+def process_incidents_batched(batch_size=SN_BATCH_SIZE):
+    writer = BatchWriter(batch_size=batch_size, max_pending=batch_size * 10)
+    count = 0
+    chunk = []
+    try:
+        for incident in fetch_open_incidents():
+            chunk.append(incident)
+            if len(chunk) == batch_size:
+                count += process_chunk(chunk, writer)
+                chunk = []
+        count += process_chunk(chunk, writer)
+    finally:
+        # Send what was queued even when fetching failed part way through
+        writer.flush()
+        save_snapshots()
+    logger.info(f'Processed {count} open incidents: {writer.applied} updates applied, {writer.failed} failed')
+
+# Function to work out what extract_field_info will do to an incident, for the sync index
+def plan_incident(incident):
+    decision, payload, needs_comment = triage_incident(incident)
+    if decision is not None:
+        return payload, f'triage:{decision.rule}'
+    action = ('comment+' if needs_comment else '') + f"state:{payload.get('state', '-')}"
+    return payload, action
+
+# Function to run one incremental sync cycle: only incidents changed since the last
+# run are fetched, and incidents we already acted on are skipped unless they changed
+def process_incidents_delta(batch=False, batch_size=SN_BATCH_SIZE):
+    # No max_pending: sync_incidents flushes the writer itself at every checkpoint,
+    # so it sees which PATCHes failed
+    writer = BatchWriter(batch_size=batch_size) if batch else None
+    state = SyncState()
+    try:
+        sync_incidents(state, plan_incident,
+                       lambda incident: extract_field_info(incident, incident.get('sys_id'), writer),
+                       writer=writer)
+    finally:
+        state.close()
+        save_snapshots()
+
+# Main function
+def main():
+    parser = argparse.ArgumentParser(description='ServiceNow incident response tool')
+    parser.add_argument('--batch', action='store_true',
+                        help='process all open incidents and write updates through the Batch API')
+    parser.add_argument('--batch-size', type=int, default=SN_BATCH_SIZE)
+    parser.add_argument('--sync', action='store_true',
+                        help='only process incidents changed since the last run')
+    parser.add_argument('--profile', action='store_true',
+                        help='print a summary of where the wall time went at the end of the run')
+    parser.add_argument('--metrics-port', type=int, default=METRICS_PORT,
+                        help='serve Prometheus metrics on this port while running (0 disables)')
+    parser.add_argument('--metrics-json', default=METRICS_JSON_PATH,
+                        help='dump metrics as JSON to this file periodically and at exit')
+    args = parser.parse_args()
+    start_exporters(args.metrics_port, args.metrics_json)
+    started = time.perf_counter()
+    try:
+        run(args)
+    finally:
+        if args.profile:
+            print(metrics.profile_summary(time.perf_counter() - started))
+
+# Function to run the mode selected on the command line
+def run(args):
+    if args.sync:
+        process_incidents_delta(args.batch, args.batch_size)
+        return
+    if args.batch:
+        process_incidents_batched(args.batch_size)
+        return
+
+    # Fetch open incidents from ServiceNow
+    open_incidents = fetch_open_incidents()
+    # Select the first open incident
+    first_incident = next(open_incidents, None)
+    if first_incident:
+
+    # if open_incidents:
+    #     logger.info(f'Found {len(open_incidents)} open incidents:')
+    #     for incident in open_incidents:
+    #         shortdesc = incident.get("short_description")
+    #         incState = incident.get("state")
+    #         logger.info(f'- {incident.get("number")}: {shortdesc}')
+            # if shortdesc == '':
+
+        # Extract information from INC fields
+        extract_field_info(first_incident,first_incident.get('sys_id'))
+        save_snapshots()
+            
+            # Add comments to incidents
+            # add_comment(incident.get('sys_id'))
+       # add_comment(first_incident.get('sys_id'),first_incident.get('number'))
+            # # Resolve incidents
+            # resolve_incident(incident.get('sys_id'))
+        # add_comment(first_incident.get('sys_id'),first_incident.get('number'))
+            # Resolve incidents
+            #   resolve_incident(incident.get('sys_id'))
+
+    else:
+        logger.info('No open incidents found.')
+
+if __name__ == "__main__":
+    main()
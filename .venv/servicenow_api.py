@@ -0,0 +1,304 @@
+import os
+import time
+import random
+import logging
+import threading
+import contextlib
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+from metrics import metrics
+
+# Load environment variables from .env file
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# ServiceNow Instance credentials
+instanceName = os.getenv('INSTANCE_NAME')
+username = os.getenv('SNUSERNAME')
+password = os.getenv('SNPASSWORD')
+
+# Base URL of the instance; SN_BASE_URL points the scripts elsewhere (e.g. the mock server)
+SN_BASE_URL = os.getenv('SN_BASE_URL', f'https://{instanceName}')
+
+# API endpoint for retrieving open incidents
+INCIDENT_API_ENDPOINT = f'{SN_BASE_URL}/api/now/table/incident'
+# API endpoint for retrieving assignment group names
+ASSIGNMENT_GROUP_ENDPOINT = f'{SN_BASE_URL}/api/now/table/sys_user_group'
+# API endpoint for retrieving the users from the assignment group
+ASSIGNEE_ENDPOINT = f'{SN_BASE_URL}/api/now/table/sys_user'
+
+# Set up authentication headers and credentials globally
+headers = {
+    'Accept': 'application/json',
+    'Content-Type': 'application/json',
+}
+auth = (username, password)
+
+# Number of records requested per page (sysparm_limit)
+PAGE_SIZE = int(os.getenv('SN_PAGE_SIZE', '500'))
+
+# Only the incident columns the scripts actually read (sysparm_fields)
+INCIDENT_FIELDS = [
+    'sys_id',
+    'number',
+    'short_description',
+    'description',
+    'state',
+    'priority',
+    'assignment_group',
+    'assigned_to',
+]
+
+
+# Connection pool size of the shared ServiceNow session
+SN_POOL_SIZE = int(os.getenv('SN_POOL_SIZE', '10'))
+# Number of times a throttled or failed request is retried before giving up
+SN_MAX_RETRIES = int(os.getenv('SN_MAX_RETRIES', '5'))
+# First and largest backoff delay in seconds between retries
+SN_BACKOFF_BASE = float(os.getenv('SN_BACKOFF_BASE', '0.5'))
+SN_BACKOFF_MAX = float(os.getenv('SN_BACKOFF_MAX', '30'))
+# Client-side request rate limit (requests per second, 0 disables) and burst size
+SN_RATE_LIMIT = float(os.getenv('SN_RATE_LIMIT', '20'))
+SN_RATE_BURST = int(os.getenv('SN_RATE_BURST', '20'))
+
+# Status codes worth retrying: throttling and transient server errors
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# Journal fields append an entry on every write, so a PATCH setting them is not idempotent
+JOURNAL_FIELDS = ('comments', 'work_notes')
+
+
+# Whether sending a request twice has the same effect as sending it once.
+# POSTs create records (or run a Batch API call) and journal PATCHes add a comment.
+def is_idempotent(method, body=None):
+    if method == 'POST':
+        return False
+    if method == 'PATCH' and isinstance(body, dict):
+        return not any(field in body for field in JOURNAL_FIELDS)
+    return True
+
+
+# Whether a requests error happened before the request was sent (connect phase)
+def connect_failed(error):
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    if isinstance(error, requests.ConnectionError) and error.args:
+        return isinstance(getattr(error.args[0], 'reason', None), NewConnectionError)
+    return False
+
+
+# Token bucket shared by all threads using a client: take() blocks until a request
+# may be sent, so we stay below the instance rate limit instead of hitting 429s.
+# reserve() books a token without blocking and returns how long to wait before using
+# it, for callers that sleep on their own (the asyncio pipeline).
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        if self.rate <= 0:
+            return 0.0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return max(0.0, -self.tokens / self.rate)
+
+    def take(self):
+        wait = self.reserve()
+        if wait:
+            time.sleep(wait)
+
+
+# Seconds to wait according to a Retry-After header (delta-seconds or HTTP date)
+def retry_after_seconds(value):
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+# ServiceNow REST client: one pooled keep-alive session for every call, retries with
+# exponential backoff and full jitter on 429/5xx and connection errors (honouring
+# Retry-After), and a token bucket in front of every request.
+# Every attempt and retry is counted in metrics per endpoint and status code.
+# Requests that are not idempotent (POST, PATCHes adding comments / work notes) are
+# only retried on 429 and on errors before the request was sent: after a read timeout
+# or a 5xx the instance may already have applied them.
+class ServiceNowClient:
+    def __init__(self, pool_size=SN_POOL_SIZE, max_retries=SN_MAX_RETRIES,
+                 backoff_base=SN_BACKOFF_BASE, backoff_max=SN_BACKOFF_MAX,
+                 rate_limit=SN_RATE_LIMIT, rate_burst=SN_RATE_BURST, timeout=30):
+        self.session = requests.Session()
+        self.session.auth = auth
+        self.session.headers.update(headers)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.bucket = TokenBucket(rate_limit, rate_burst)
+        self.timeout = timeout
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    # Whether a response is worth retrying (non-idempotent requests only when throttled)
+    def should_retry(self, status_code, attempt, idempotent=True):
+        if attempt >= self.max_retries:
+            return False
+        if not idempotent:
+            return status_code == 429
+        return status_code in RETRY_STATUS_CODES
+
+    # Whether a failed attempt is worth retrying; connect_phase tells whether the
+    # error happened before anything was sent
+    def should_retry_error(self, attempt, idempotent=True, connect_phase=False):
+        return attempt < self.max_retries and (idempotent or connect_phase)
+
+    # Delay before the next attempt, honouring Retry-After on a 429
+    def retry_delay(self, attempt, status_code=None, retry_after=None):
+        delay = self.backoff(attempt)
+        if status_code == 429:
+            delay = retry_after_seconds(retry_after) or delay
+        return delay
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        idempotent = is_idempotent(method, kwargs.get('json'))
+        attempt = 0
+        while True:
+            self.bucket.take()
+            started = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                metrics.record_request(method, url, 'error', time.perf_counter() - started)
+                if not self.should_retry_error(attempt, idempotent, connect_failed(e)):
+                    raise
+                metrics.record_retry(method, url, type(e).__name__)
+                delay = self.backoff(attempt)
+                logger.warning(f'{method} {url} failed ({str(e)}), retrying in {delay:.1f}s')
+            else:
+                metrics.record_request(method, url, response.status_code, time.perf_counter() - started)
+                if not self.should_retry(response.status_code, attempt, idempotent):
+                    return response
+                metrics.record_retry(method, url, response.status_code)
+                delay = self.retry_delay(attempt, response.status_code, response.headers.get('Retry-After'))
+                logger.warning(f'{method} {url} returned {response.status_code}, retrying in {delay:.1f}s')
+            attempt += 1
+            time.sleep(delay)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        return self.request('PATCH', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+# Shared client used by every ServiceNow call in these scripts
+sn_client = ServiceNowClient()
+
+
+# Raised when a page of records cannot be fetched, so callers can tell a failed
+# fetch apart from the end of the data
+class FetchError(Exception):
+    def __init__(self, endpoint, status_code):
+        super().__init__(f'Error fetching page from {endpoint}: {status_code}')
+        self.endpoint = endpoint
+        self.status_code = status_code
+
+
+# Function to build the Table API query parameters for one page of records
+def page_params(query, fields, limit, offset=None):
+    params = {
+        'sysparm_query': query,
+        'sysparm_limit': limit,
+        'sysparm_exclude_reference_link': 'true',
+    }
+    if fields:
+        params['sysparm_fields'] = ','.join(fields)
+    if offset is not None:
+        params['sysparm_offset'] = offset
+    return params
+
+
+# Function to build the query for the page after last_key when keyset paging on sys_id
+def keyset_query(query, last_key):
+    return query + (f'^sys_id>{last_key}' if last_key else '') + '^ORDERBYsys_id'
+
+
+# Function to fetch a single page of records from a ServiceNow table.
+# With a stage name the request is timed as that stage in metrics.
+def fetch_page(endpoint, query, fields, limit, offset=None, stage=None):
+    params = page_params(query, fields, limit, offset)
+    with metrics.stage(stage) if stage else contextlib.nullcontext():
+        response = sn_client.get(endpoint, params=params)
+
+    # Check if the request was successful (status code 200)
+    if response.status_code == 200:
+        return response.json().get('result', [])
+    else:
+        raise FetchError(endpoint, response.status_code)
+
+
+# Generator that pages through a ServiceNow table and yields records one at a time.
+# Keyset paging orders by sys_id and asks for sys_id > last seen key, so deep pages
+# cost the same as the first one; offset paging uses sysparm_offset instead and is
+# meant for queries that carry their own ORDERBY. The next page is requested on a
+# background thread while the current page is being consumed. A page that cannot be
+# fetched raises FetchError instead of ending the stream early.
+def iter_records(endpoint, query, fields=None, page_size=None, keyset=True, stage=None):
+    page_size = page_size or PAGE_SIZE
+    if keyset and fields and 'sys_id' not in fields:
+        fields = ['sys_id'] + list(fields)
+
+    def request_page(last_key, offset):
+        if keyset:
+            return fetch_page(endpoint, keyset_query(query, last_key), fields, page_size, stage=stage)
+        return fetch_page(endpoint, query, fields, page_size, offset=offset, stage=stage)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        offset = 0
+        pending = executor.submit(request_page, None, offset)
+        while pending is not None:
+            page = pending.result()
+            if not page:
+                return
+            offset += len(page)
+            # Prefetch the next page before handing out the current one
+            if len(page) < page_size:
+                pending = None
+            else:
+                pending = executor.submit(request_page, page[-1].get('sys_id'), offset)
+            for record in page:
+                yield record
+
+
+# Function to stream all active incidents, projected to INCIDENT_FIELDS
+def iter_open_incidents(page_size=None, fields=None):
+    return iter_records(INCIDENT_API_ENDPOINT, 'active=true',
+                        fields=fields or INCIDENT_FIELDS, page_size=page_size, stage='fetch')
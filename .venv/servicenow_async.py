@@ -0,0 +1,224 @@
+import os
+import time
+import asyncio
+import logging
+import argparse
+import httpx
+from openai import AsyncOpenAI
+from servicenow import triage_incident, comment_prompt, gptModel, COMPLETION_PARAMS
+from completion_cache import completion_cache, cache_key
+from servicenow_api import (INCIDENT_API_ENDPOINT, INCIDENT_FIELDS, PAGE_SIZE,
+                            headers, auth, page_params, keyset_query, sn_client, FetchError,
+                            is_idempotent)
+from metrics import metrics, start_exporters, METRICS_PORT, METRICS_JSON_PATH
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of ServiceNow requests in flight at once
+SN_CONCURRENCY = int(os.getenv('SN_CONCURRENCY', '8'))
+# Maximum number of OpenAI completion requests in flight at once
+LLM_CONCURRENCY = int(os.getenv('LLM_CONCURRENCY', '4'))
+
+
+# Async counterpart of servicenow_api.ServiceNowClient.request: same retry rules,
+# backoff settings and token bucket as the shared sn_client, so the async pipeline
+# and the threaded scripts stay under one rate limit, but waits with asyncio.sleep
+class AsyncServiceNowClient:
+    def __init__(self, http, client=sn_client):
+        self.http = http
+        self.client = client
+
+    async def request(self, method, url, **kwargs):
+        idempotent = is_idempotent(method, kwargs.get('json'))
+        attempt = 0
+        while True:
+            wait = self.client.bucket.reserve()
+            if wait:
+                await asyncio.sleep(wait)
+            started = time.perf_counter()
+            try:
+                response = await self.http.request(method, url, **kwargs)
+            except httpx.TransportError as e:
+                metrics.record_request(method, url, 'error', time.perf_counter() - started)
+                connect_phase = isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout))
+                if not self.client.should_retry_error(attempt, idempotent, connect_phase):
+                    raise
+                metrics.record_retry(method, url, type(e).__name__)
+                delay = self.client.backoff(attempt)
+                logger.warning(f'{method} {url} failed ({str(e)}), retrying in {delay:.1f}s')
+            else:
+                metrics.record_request(method, url, response.status_code, time.perf_counter() - started)
+                if not self.client.should_retry(response.status_code, attempt, idempotent):
+                    return response
+                metrics.record_retry(method, url, response.status_code)
+                delay = self.client.retry_delay(attempt, response.status_code, response.headers.get('Retry-After'))
+                logger.warning(f'{method} {url} returned {response.status_code}, retrying in {delay:.1f}s')
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def get(self, url, **kwargs):
+        return await self.request('GET', url, **kwargs)
+
+    async def patch(self, url, **kwargs):
+        return await self.request('PATCH', url, **kwargs)
+
+
+# Async generator that pages through active incidents with keyset paging,
+# requesting the next page while the current one is handed to the pipeline
+async def iter_open_incidents_async(http, page_size=None):
+    page_size = page_size or PAGE_SIZE
+
+    async def request_page(last_key):
+        params = page_params(keyset_query('active=true', last_key), INCIDENT_FIELDS, page_size)
+        with metrics.stage('fetch'):
+            response = await http.get(INCIDENT_API_ENDPOINT, params=params)
+        if response.status_code == 200:
+            return response.json().get('result', [])
+        raise FetchError(INCIDENT_API_ENDPOINT, response.status_code)
+
+    pending = asyncio.create_task(request_page(None))
+    while pending is not None:
+        page = await pending
+        if not page:
+            return
+        if len(page) < page_size:
+            pending = None
+        else:
+            pending = asyncio.create_task(request_page(page[-1].get('sys_id')))
+        for incident in page:
+            yield incident
+
+
+class IncidentPipeline:
+    def __init__(self, http, llm, sn_concurrency=SN_CONCURRENCY, llm_concurrency=LLM_CONCURRENCY):
+        self.http = http
+        self.llm = llm
+        self.sn_limit = asyncio.Semaphore(sn_concurrency)
+        self.llm_limit = asyncio.Semaphore(llm_concurrency)
+        self.workers = sn_concurrency + llm_concurrency
+        self.processed = 0
+        self.failed = 0
+
+    # Async version of servicenow.generate_text, sharing its completion cache.
+    # The SQLite cache is called on a worker thread so it never blocks the event loop.
+    async def generate_text(self, description, short_description):
+        prompt = comment_prompt(description, short_description)
+        key = cache_key(prompt, gptModel, **COMPLETION_PARAMS)
+        text = await asyncio.to_thread(completion_cache.get, key)
+        if text is not None:
+            return text
+        async with self.llm_limit:
+            with metrics.stage('llm_generation'):
+                response = await self.llm.completions.create(
+                    model=gptModel,
+                    prompt=prompt,
+                    **COMPLETION_PARAMS
+                )
+        metrics.record_completion(gptModel, response)
+        text = response.choices[0].text.strip()
+        await asyncio.to_thread(completion_cache.put, key, text)
+        return text
+
+    # PATCH an incident record, bounded by the ServiceNow concurrency limit and timed as the given stage
+    async def patch_incident(self, incident_sys_id, payload, stage='state_write'):
+        async with self.sn_limit:
+            with metrics.stage(stage):
+                response = await self.http.patch(f'{INCIDENT_API_ENDPOINT}/{incident_sys_id}', json=payload)
+        if response.status_code != 200:
+            logger.error(f'Error updating incident {incident_sys_id}: {response.status_code}')
+            return False
+        return True
+
+    # Async version of servicenow.add_comment
+    async def add_comment(self, incident_sys_id, description, short_description, comment=None):
+        if comment is None:
+            comment = await self.generate_text(description, short_description)
+        payload = {
+            'comments': comment,
+            'incident': incident_sys_id
+        }
+        return await self.patch_incident(incident_sys_id, payload, 'comment_write')
+
+    # Async version of servicenow.extract_field_info: triage, comment and/or move the state on
+    async def process_incident(self, incident):
+        sys_id = incident.get('sys_id')
+        decision, payload, needs_comment = triage_incident(incident)
+        if decision is not None and decision.action == 'resolve':
+            resolved = {'close_code': 'Resolved by request', 'close_notes': decision.close_notes, 'state': '6'}
+            return (await self.patch_incident(sys_id, resolved, 'resolve_close')
+                    and await self.patch_incident(sys_id, payload, 'resolve_close'))
+        ok = True
+        if needs_comment or (decision is not None and decision.comment):
+            ok = await self.add_comment(sys_id, incident.get('description'), incident.get('short_description'),
+                                        decision.comment if decision is not None else None)
+        if ok and payload:
+            ok = await self.patch_incident(sys_id, payload)
+        return ok
+
+    async def worker(self, queue):
+        while True:
+            incident = await queue.get()
+            try:
+                if incident is None:
+                    return
+                if await self.process_incident(incident):
+                    self.processed += 1
+                else:
+                    self.failed += 1
+            except Exception as e:
+                self.failed += 1
+                logger.error(f'Error processing incident {incident.get("number")}: {str(e)}')
+            finally:
+                queue.task_done()
+
+    # Feed every open incident through a bounded queue to the worker tasks
+    async def run(self, page_size=None):
+        queue = asyncio.Queue(maxsize=self.workers * 2)
+        workers = [asyncio.create_task(self.worker(queue)) for _ in range(self.workers)]
+        try:
+            async for incident in iter_open_incidents_async(self.http, page_size):
+                await queue.put(incident)
+        finally:
+            # Let the workers finish the queued incidents even if fetching failed
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+
+
+async def run_async(sn_concurrency=SN_CONCURRENCY, llm_concurrency=LLM_CONCURRENCY, page_size=None):
+    limits = httpx.Limits(max_connections=sn_concurrency + 1, max_keepalive_connections=sn_concurrency + 1)
+    async with httpx.AsyncClient(headers=headers, auth=auth, limits=limits, timeout=30) as http:
+        async with AsyncOpenAI() as llm:
+            pipeline = IncidentPipeline(AsyncServiceNowClient(http), llm, sn_concurrency, llm_concurrency)
+            started = time.perf_counter()
+            await pipeline.run(page_size)
+            elapsed = time.perf_counter() - started
+    total = pipeline.processed + pipeline.failed
+    rate = total / elapsed if elapsed else 0.0
+    logger.info(f'Processed {total} incidents ({pipeline.failed} failed) in {elapsed:.2f}s: {rate:.2f} incidents/s')
+    return pipeline
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Process all open incidents concurrently')
+    parser.add_argument('--sn-concurrency', type=int, default=SN_CONCURRENCY)
+    parser.add_argument('--llm-concurrency', type=int, default=LLM_CONCURRENCY)
+    parser.add_argument('--page-size', type=int, default=PAGE_SIZE)
+    parser.add_argument('--profile', action='store_true',
+                        help='print a summary of where the wall time went at the end of the run')
+    parser.add_argument('--metrics-port', type=int, default=METRICS_PORT,
+                        help='serve Prometheus metrics on this port while running (0 disables)')
+    parser.add_argument('--metrics-json', default=METRICS_JSON_PATH,
+                        help='dump metrics as JSON to this file periodically and at exit')
+    args = parser.parse_args()
+    start_exporters(args.metrics_port, args.metrics_json)
+    started = time.perf_counter()
+    try:
+        asyncio.run(run_async(args.sn_concurrency, args.llm_concurrency, args.page_size))
+    finally:
+        if args.profile:
+            print(metrics.profile_summary(time.perf_counter() - started))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import os
+from dotenv import load_dotenv
+from servicenow_api import SN_BASE_URL, sn_client, iter_open_incidents
+from triage import TriageEngine, TRIAGE_LEGACY_RULES_PATH
+
+# Load environment variables from .env file
+load_dotenv()
+
+
+# ServiceNow Developer Instance credentials
+instanceName = os.getenv('INSTANCE_NAME')
+username = os.getenv('SNUSERNAME')
+password = os.getenv('SNPASSWORD')
+
+
+# Open incidents are read through servicenow_api; endpoints are built on SN_BASE_URL
+
+# API endpoint for creating incident resolutions
+#RESOLUTION_API_ENDPOINT = f'https://{instanceName}/api/now/table/incident'
+# API endpoint for creating incident resolutions
+RESOLUTION_API_ENDPOINT = f'{SN_BASE_URL}/api/now/table/incident_resolution'
+
+
+# Rules picking the routine issues that get a canned resolution (triage_rules_legacy.json)
+routine_triage = TriageEngine.from_file(TRIAGE_LEGACY_RULES_PATH)
+
+# Function to fetch open incidents from ServiceNow, one page at a time
+def fetch_open_incidents(page_size=None):
+    return iter_open_incidents(page_size=page_size)
+
+# Function to automatically generate resolutions for routine issues
+def generate_resolution(incident):
+    # Check the incident against the routine issue rules
+    decision = routine_triage.classify(incident)
+    if decision is not None:
+        # Use the canned text of the matched rule as the resolution
+        return decision.comment
+    else:
+        return None
+
+# Function to create incident resolutions in ServiceNow
+def create_resolution(incident, resolution):
+    # Construct payload for creating resolution
+    payload = {
+        'description': resolution,
+        'incident': incident.get('sys_id')
+    }
+
+    # Make a POST request to the resolution API endpoint
+    response = sn_client.post(RESOLUTION_API_ENDPOINT, json=payload)
+
+    # Check if the request was successful (status code 201)
+    if response.status_code == 201:
+        print(f'Resolution created for incident: {incident.get("number")}')
+    else:
+        print(f'Error creating resolution for incident {incident.get("number")}: {response.status_code}')
+
+# Main function
+def main():
+    # Fetch open incidents from ServiceNow
+    open_incidents = fetch_open_incidents()
+    count = 0
+    for incident in open_incidents:
+        count += 1
+        print(f'- {incident.get("number")}: {incident.get("short_description")}')
+        # Automatically generate resolution for routine issues
+        resolution = generate_resolution(incident)
+        if resolution:
+            # Create resolution in ServiceNow
+            create_resolution(incident, resolution)
+    if count:
+        print(f'Processed {count} open incidents')
+    else:
+        print('No open incidents found.')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+import os
+from dotenv import load_dotenv
+from servicenow_api import SN_BASE_URL, sn_client, iter_open_incidents
+from triage import TriageEngine, TRIAGE_LEGACY_RULES_PATH
+from completion_cache import completion_cache, cache_key
+from metrics import metrics
+from openai import OpenAI
+import openai
+
+# Load environment variables from .env file
+load_dotenv()
+
+# OpenAI API key
+openai_api_key = os.getenv('OPENAI_API_KEY')
+gptModel = os.getenv('OPENAI_MODEL')
+# ServiceNow Developer Instance credentials
+instanceName = os.getenv('INSTANCE_NAME')
+username = os.getenv('SNUSERNAME')
+password = os.getenv('SNPASSWORD')
+
+# Open incidents are read through servicenow_api; endpoints are built on SN_BASE_URL
+
+# API endpoint for creating incident resolutions
+RESOLUTION_API_ENDPOINT = f'{SN_BASE_URL}/api/now/table/incident'
+
+client =  OpenAI()
+
+# Rules picking the routine issues that get a generated resolution (triage_rules_legacy.json)
+routine_triage = TriageEngine.from_file(TRIAGE_LEGACY_RULES_PATH)
+
+# Function to fetch open incidents from ServiceNow, one page at a time
+def fetch_open_incidents(page_size=None):
+    return iter_open_incidents(page_size=page_size)
+
+# Function to generate resolution using OpenAI's API
+def generate_resolution(incident):
+    # Check the incident against the routine issue rules
+    description = incident.get('description', '')
+    if routine_triage.classify(incident) is not None:
+        # Call OpenAI's API to generate response
+        prompt = "Incident description: " + description
+        response = generate_openai_response(prompt)
+        return response
+    else:
+        return None
+
+# Function to call OpenAI's API and generate response, reusing cached completions.
+# Goes through the OpenAI client so OPENAI_BASE_URL is honoured and response.usage
+# is recorded in metrics.
+def generate_openai_response(prompt):
+    key = cache_key(prompt, gptModel, max_tokens=100)
+    cached = completion_cache.get(key)
+    if cached is not None:
+        return cached
+    try:
+        with metrics.stage('llm_generation'):
+            response = client.completions.create(
+                #model="text-davinci-003",  # You can choose any model from OpenAI, such as text-davinci-002
+                model=gptModel,
+                prompt=prompt,
+                max_tokens=100
+            )
+    except openai.APIError as e:
+        print(f"Error generating response from OpenAI: {str(e)}")
+        return None
+    metrics.record_completion(gptModel, response)
+    text = response.choices[0].text.strip()
+    completion_cache.put(key, text)
+    return text
+
+# Function to create incident resolutions in ServiceNow
+def create_resolution(incident, resolution):
+    # Construct payload for creating resolution
+    payload = {
+        'description': resolution,
+        'incident': incident.get('sys_id')
+    }
+
+    # Make a POST request to the resolution API endpoint
+    response = sn_client.post(RESOLUTION_API_ENDPOINT, json=payload)
+
+    # Check if the request was successful (status code 201)
+    if response.status_code == 201:
+        print(f'Resolution created for incident: {incident.get("number")}')
+    else:
+        print(f'Error creating resolution for incident {incident.get("number")}: {response.status_code}')
+
+# Main function
+def main():
+    # Fetch open incidents from ServiceNow
+    open_incidents = fetch_open_incidents()
+    count = 0
+    for incident in open_incidents:
+        count += 1
+        print(f'- {incident.get("number")}: {incident.get("short_description")}')
+        # Automatically generate resolution for routine issues
+        resolution = generate_resolution(incident)
+        if resolution:
+            # Create resolution in ServiceNow
+            create_resolution(incident, resolution)
+    if count:
+        print(f'Processed {count} open incidents')
+    else:
+        print('No open incidents found.')
+
+if __name__ == "__main__":
+    main()
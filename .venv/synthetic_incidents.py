@@ -0,0 +1,101 @@
+import random
+from datetime import datetime, timedelta
+
+# Share of active incidents in each state (New, In Progress, On Hold)
+STATE_WEIGHTS = {'1': 0.35, '2': 0.40, '3': 0.25}
+# Share of incidents per priority (1 - Critical ... 5 - Planning)
+PRIORITY_WEIGHTS = {'1': 0.03, '2': 0.12, '3': 0.45, '4': 0.30, '5': 0.10}
+# Share of incidents without an assignee
+UNASSIGNED_RATE = 0.3
+
+# (short description, description) templates; the first few dominate, like the
+# password resets and VPN issues that make up most of a real queue
+ISSUE_TEMPLATES = [
+    ('Password reset', 'User {user} is locked out and needs a password reset for {system}.'),
+    ('VPN not connecting', 'VPN client on {device} fails to connect from {site}. Error: {error}.'),
+    ('Outlook not syncing', 'Outlook on {device} stopped syncing mail since {when}.'),
+    ('Printer offline', 'Printer on floor {floor} at {site} shows offline for everyone.'),
+    ('Access request', 'Please grant {user} access to {system}, approved by manager.'),
+    ('Laptop slow', '{device} takes several minutes to boot and applications freeze.'),
+    ('Software install', 'Install {system} client on {device} for {user}.'),
+    ('Wi-Fi drops', 'Wi-Fi at {site} drops every few minutes on floor {floor}.'),
+    ('MFA not working', 'MFA prompt never arrives on the phone of {user} when signing in to {system}.'),
+    ('Shared drive missing', 'Mapped shared drive for the finance team is missing on {device}.'),
+    ('Application error', '{system} returns "{error}" when saving a record.'),
+    ('Routine maintenance', 'Regular routine maintenance window for {system} requested.'),
+]
+# Relative frequency of each template (same order as ISSUE_TEMPLATES)
+ISSUE_WEIGHTS = [30, 20, 8, 7, 7, 6, 5, 5, 4, 3, 3, 2]
+
+SYSTEMS = ['SAP', 'Salesforce', 'Workday', 'Jira', 'Confluence', 'ServiceNow', 'Office 365']
+DEVICES = ['Windows laptop', 'MacBook', 'thin client', 'desktop PC']
+SITES = ['London', 'Chennai', 'New York', 'Berlin', 'Singapore', 'home office']
+ERRORS = ['timeout', 'error 809', 'certificate expired', 'access denied', 'HTTP 500']
+WHEN = ['yesterday', 'this morning', 'last week', 'the latest update']
+
+GROUP_NAMES = ['Service Desk', 'Network', 'Hardware', 'Software', 'Database', 'Identity & Access',
+               'Messaging', 'Field Services', 'Application Support', 'Infrastructure']
+
+
+def sys_id(rng):
+    return '%032x' % rng.getrandbits(128)
+
+
+def timestamp(moment):
+    return moment.strftime('%Y-%m-%d %H:%M:%S')
+
+
+# Function to generate the assignment groups (sys_user_group) and users (sys_user)
+def generate_reference_data(rng, groups=40, users=500, start=None):
+    start = start or datetime(2024, 1, 1)
+    group_records = []
+    for i in range(groups):
+        group_records.append({
+            'sys_id': sys_id(rng),
+            'name': f'{GROUP_NAMES[i % len(GROUP_NAMES)]} {i // len(GROUP_NAMES) + 1}',
+            'type': 'assignment_group',
+            'sys_updated_on': timestamp(start + timedelta(minutes=i)),
+        })
+    user_records = []
+    for i in range(users):
+        user_records.append({
+            'sys_id': sys_id(rng),
+            'name': f'User {i:04d}',
+            'user_name': f'user{i:04d}',
+            'sys_updated_on': timestamp(start + timedelta(minutes=i)),
+        })
+    return group_records, user_records
+
+
+# Function to generate n active incidents with realistic state, priority and
+# description distributions. Returns (incidents, groups, users).
+def generate_incidents(n, seed=42, groups=40, users=500):
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    group_records, user_records = generate_reference_data(rng, groups, users, start)
+    states = list(STATE_WEIGHTS)
+    state_weights = list(STATE_WEIGHTS.values())
+    priorities = list(PRIORITY_WEIGHTS)
+    priority_weights = list(PRIORITY_WEIGHTS.values())
+
+    incidents = []
+    for i in range(n):
+        short_description, template = rng.choices(ISSUE_TEMPLATES, ISSUE_WEIGHTS)[0]
+        user = rng.choice(user_records)
+        description = template.format(
+            user=user['name'], system=rng.choice(SYSTEMS), device=rng.choice(DEVICES),
+            site=rng.choice(SITES), error=rng.choice(ERRORS), when=rng.choice(WHEN),
+            floor=rng.randint(1, 9))
+        incidents.append({
+            'sys_id': sys_id(rng),
+            'number': f'INC{i + 1:07d}',
+            'short_description': short_description,
+            'description': description,
+            'state': rng.choices(states, state_weights)[0],
+            'priority': rng.choices(priorities, priority_weights)[0],
+            'assignment_group': rng.choice(group_records)['sys_id'],
+            'assigned_to': '' if rng.random() < UNASSIGNED_RATE else rng.choice(user_records)['sys_id'],
+            'active': 'true',
+            'sys_updated_on': timestamp(start + timedelta(seconds=i * 7)),
+        })
+    return incidents, group_records, user_records
@@ -0,0 +1,147 @@
+import os
+import re
+import json
+import time
+import logging
+import argparse
+
+logger = logging.getLogger(__name__)
+
+# Rules file used by the scripts
+TRIAGE_RULES_PATH = os.getenv('TRIAGE_RULES_PATH',
+                              os.path.join(os.path.dirname(os.path.abspath(__file__)), 'triage_rules.json'))
+
+# Rules used by servicenow_v1 / servicenow_v2 to pick incidents that get a resolution
+# record; their single-word patterns only suit non-closing actions
+TRIAGE_LEGACY_RULES_PATH = os.getenv('TRIAGE_LEGACY_RULES_PATH',
+                                     os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                  'triage_rules_legacy.json'))
+
+# Lowest urgency an incident needs before a rule may resolve and close it: priorities
+# run from 1 (Critical) to 5 (Planning), so the default 3 never auto-closes P1/P2
+TRIAGE_CLOSE_MIN_PRIORITY = int(os.getenv('TRIAGE_CLOSE_MIN_PRIORITY', '3'))
+
+# What a matched rule does: add a canned comment (with the usual state transition),
+# resolve and close with canned close notes, or move to a fixed state
+ACTIONS = ('comment', 'resolve', 'state')
+
+
+# Outcome of triaging one incident
+class TriageDecision:
+    def __init__(self, rule, action, comment=None, close_notes=None, state=None):
+        self.rule = rule
+        self.action = action
+        self.comment = comment
+        self.close_notes = close_notes
+        self.state = state
+
+    def __repr__(self):
+        return f'TriageDecision(rule={self.rule!r}, action={self.action!r})'
+
+
+# Rule-based pre-triage run before any LLM call.
+# All patterns of all rules are compiled into one case-insensitive regex with a named
+# group per rule, so an incident is classified in a single pass over its text. The
+# regex only tries the alternation at phrase starts whose first character begins some
+# pattern, which keeps it at a few microseconds per incident. When several rules
+# match, the one listed first in the rules file wins.
+# Resolve rules close tickets, so they only load with "auto_close": true, their
+# patterns must be phrases of two or more words, and they never apply to incidents
+# more urgent than close_min_priority.
+class TriageEngine:
+    def __init__(self, rules, close_min_priority=TRIAGE_CLOSE_MIN_PRIORITY):
+        self.close_min_priority = close_min_priority
+        self.decisions = []
+        alternatives = []
+        first_chars = set()
+        for index, rule in enumerate(rules):
+            action = rule.get('action')
+            if action not in ACTIONS:
+                raise ValueError(f"Triage rule '{rule.get('name')}' has unknown action '{action}'")
+            patterns = rule.get('patterns') or []
+            if not patterns:
+                continue
+            if action == 'resolve':
+                if not rule.get('auto_close'):
+                    logger.warning(f"Triage rule '{rule.get('name')}' resolves incidents but does not set "
+                                   f"auto_close, skipping it")
+                    continue
+                single_words = [p for p in patterns if len(p.split()) < 2]
+                if single_words:
+                    raise ValueError(f"Triage rule '{rule.get('name')}' resolves incidents on single words "
+                                     f"{single_words}; use specific phrases")
+            self.decisions.append(TriageDecision(
+                rule.get('name', f'rule{index}'), action, rule.get('comment'),
+                rule.get('close_notes'), rule.get('state')))
+            group = f'r{len(self.decisions) - 1}'
+            words = '|'.join(re.escape(p) for p in sorted(patterns, key=len, reverse=True))
+            alternatives.append(f'(?P<{group}>{words})')
+            first_chars.update(c for p in patterns for c in (p[0].lower(), p[0].upper()))
+        self.pattern = None
+        if alternatives:
+            starts = re.escape(''.join(sorted(first_chars)))
+            # (?<!\w) / (?!\w) instead of \b, so patterns that start or end with
+            # punctuation, e.g. "(broken)", still match as whole phrases
+            self.pattern = re.compile(f'(?<!\\w)(?=[{starts}])(?:{"|".join(alternatives)})(?!\\w)',
+                                      re.IGNORECASE)
+
+    @classmethod
+    def from_file(cls, path=TRIAGE_RULES_PATH):
+        try:
+            with open(path) as f:
+                return cls(json.load(f))
+        except FileNotFoundError:
+            logger.warning(f'Triage rules file {path} not found, every incident goes to the LLM')
+            return cls([])
+
+    # Returns the TriageDecision for an incident, or None if no rule matches
+    def classify(self, incident):
+        if self.pattern is None:
+            return None
+        text = (incident.get('short_description') or '') + '\n' + (incident.get('description') or '')
+        matched = {int(match.lastgroup[1:]) for match in self.pattern.finditer(text)}
+        for index in sorted(matched):
+            decision = self.decisions[index]
+            if decision.action == 'resolve' and not self.may_close(incident):
+                continue
+            return decision
+        return None
+
+    # Whether an incident is low enough priority to be closed by a rule
+    def may_close(self, incident):
+        try:
+            return int(incident.get('priority')) >= self.close_min_priority
+        except (TypeError, ValueError):
+            return False
+
+    def classify_many(self, incidents):
+        return [self.classify(incident) for incident in incidents]
+
+
+# Shared engine loaded from TRIAGE_RULES_PATH
+triage_engine = TriageEngine.from_file()
+
+
+# Classify a batch of synthetic incidents and print the hit rate and timing
+def main():
+    from synthetic_incidents import generate_incidents
+    parser = argparse.ArgumentParser(description='Run the triage rules over synthetic incidents')
+    parser.add_argument('--incidents', type=int, default=10000)
+    parser.add_argument('--rules', default=TRIAGE_RULES_PATH)
+    args = parser.parse_args()
+    engine = TriageEngine.from_file(args.rules)
+    incidents, _, _ = generate_incidents(args.incidents)
+    started = time.perf_counter()
+    decisions = engine.classify_many(incidents)
+    elapsed = time.perf_counter() - started
+    counts = {}
+    for decision in decisions:
+        name = decision.rule if decision else '(llm)'
+        counts[name] = counts.get(name, 0) + 1
+    print(f'Classified {len(incidents)} incidents in {elapsed * 1000:.1f} ms')
+    for name, count in sorted(counts.items(), key=lambda item: -item[1]):
+        print(f'{name:>16}: {count} ({count / len(incidents):.0%})')
+
+
+if __name__ == "__main__":
+    main()